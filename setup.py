@@ -6,5 +6,10 @@ setup(
     author='Christian Vogl',
     author_email='cvogl@mpa-garching.mpg.de',
     packages=find_packages(),
-    package_data={'snII_cosmo_tools': ['templates/*.html']}
+    package_data={'snII_cosmo_tools': ['templates/*.html']},
+    entry_points={
+        'console_scripts': [
+            'snII-catalogue-build=snII_cosmo_tools.catalogue_build:main'
+        ]
+    }
 )
@@ -3,13 +3,16 @@ from .style import (highlight_dec_cut, highlight_visibility,
                     insert_tns_links_into_df,
                     insert_survey_links_into_df,
                     highlight_gal_lat, get_styled_html_table,
-                    highlight_general_traffic_light)
+                    highlight_general_traffic_light, get_table_styles)
 from .tns_downloader import (TNSDownloader, TNSSpectrum,
                              TNSDownloadError, ZtfLightCurveDownloader)
+from .tns_cache import TNSCache
 from .filter_targets import TargetFilter, InteractiveTargetFilter
 from .visibility import insert_max_alt_in_frame, insert_gal_lat_in_frame
+from .coordinates import insert_coords_in_frame
 from .visualization import TargetVisualizer
-from .visibility import Visibility, InteractiveVisibility
+from .visibility import (Visibility, InteractiveVisibility,
+                         VisibilityPlanner)
 from .redshift import (GladeRedshiftCatalogue, TwodFRedshiftCatalogue,
                        SDSSRedshiftCatalogue)
 from .ob_generation import OBGenerator
@@ -1,12 +1,191 @@
 import os
 import bs4
+import time
+import atexit
 import gspread
 import getpass
 import datetime
 import warnings
+import threading
 import pandas as pd
+from pandas.api.types import is_numeric_dtype
 from ipywidgets import Textarea, Button, Dropdown
 from oauth2client.service_account import ServiceAccountCredentials
+from .coordinates import coord_columns
+
+
+class ArchiveRegistry(object):
+    max_age = 60.
+    _registries = {}
+
+    def __init__(self):
+        self.names = set()
+        self.last_refresh = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def get(cls, *args):
+        key = (cls,) + args
+        if key not in cls._registries:
+            cls._registries[key] = cls(*args)
+        return cls._registries[key]
+
+    def refresh(self):
+        pass
+
+    def sync(self):
+        if self.last_refresh is None or \
+                time.monotonic() - self.last_refresh > self.max_age:
+            self.refresh()
+            self.last_refresh = time.monotonic()
+
+    def add(self, name):
+        with self.lock:
+            self.names.add(name)
+
+    def __contains__(self, name):
+        self.sync()
+        with self.lock:
+            return name in self.names
+
+
+class LocalArchiveRegistry(ArchiveRegistry):
+    def __init__(self, archive_path):
+        super().__init__()
+        self.archive_path = archive_path
+        self.mtime = None
+
+    def refresh(self):
+        if not os.path.isfile(self.archive_path):
+            return
+        mtime = os.path.getmtime(self.archive_path)
+        if mtime == self.mtime:
+            return
+        names = LocalTargetArchiver.read_archived_names(self.archive_path)
+        with self.lock:
+            self.names.update(names)
+        self.mtime = mtime
+
+
+class GspreadArchiveRegistry(ArchiveRegistry):
+    spreadsheet_name = 'snII_cosmo_targets_archive'
+    scope = ['https://spreadsheets.google.com/feeds',
+             'https://www.googleapis.com/auth/drive']
+
+    def __init__(self, json_keyfile_name, sheet=None):
+        super().__init__()
+        if sheet is None:
+            credentials = ServiceAccountCredentials.from_json_keyfile_name(
+                json_keyfile_name, self.scope
+            )
+            client = gspread.authorize(credentials)
+            sheet = client.open(self.spreadsheet_name)
+        self.sheet = sheet
+        self.write_queue = SheetWriteQueue(sheet)
+        self.num_rows = 0
+        self._columns = None
+
+    @property
+    def columns(self):
+        if not self._columns:
+            self._columns = self.sheet.sheet1.row_values(1)
+        return self._columns
+
+    def refresh(self):
+        # new rows are inserted at the top, below the header
+        cells = self.sheet.sheet1.col_values(self.columns.index('Name') + 1)
+        num_new = len(cells) - 1 - self.num_rows
+        if num_new <= 0:
+            return
+        names = GspreadTargetArchiver.get_name_from_href(cells[1:1 + num_new])
+        with self.lock:
+            self.names.update(names)
+        self.num_rows += num_new
+
+
+class SheetWriteQueue(object):
+    flush_interval = 2.
+    max_retries = 5
+    backoff_factor = 1.
+    retry_interval = 30.
+    max_retry_interval = 600.
+
+    def __init__(self, sheet):
+        self.sheet = sheet
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.event = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+
+    def put(self, destination, row):
+        with self.lock:
+            self.pending.setdefault(destination, []).append(row)
+        self.event.set()
+
+    def run(self):
+        retry_interval = self.retry_interval
+        while not self.stopped.is_set():
+            self.event.wait()
+            # let the rows of consecutive clicks pile up
+            if self.stopped.wait(self.flush_interval):
+                return
+            self.event.clear()
+            if self.flush():
+                retry_interval = self.retry_interval
+                continue
+            # failed rows are back in the queue, retry them later
+            # or as soon as new rows arrive
+            self.event.wait(retry_interval)
+            retry_interval = min(2 * retry_interval, self.max_retry_interval)
+            self.event.set()
+
+    def close(self):
+        self.stopped.set()
+        self.event.set()
+        self.thread.join()
+        atexit.unregister(self.flush)
+        return self.flush()
+
+    def flush(self):
+        success = True
+        with self.write_lock:
+            with self.lock:
+                pending, self.pending = self.pending, {}
+            for destination, rows in pending.items():
+                try:
+                    self.write_rows(destination, rows)
+                except Exception as e:
+                    success = False
+                    with self.lock:
+                        self.pending[destination] = \
+                            rows + self.pending.get(destination, [])
+                    warnings.warn(
+                        'Could not archive {} rows to {!r}: {}'.format(
+                            len(rows), destination, e)
+                    )
+        return success
+
+    @staticmethod
+    def is_quota_error(error):
+        response = getattr(error, 'response', None)
+        return getattr(response, 'status_code', None) == 429
+
+    def write_rows(self, destination, rows):
+        worksheet = self.sheet.worksheet(destination)
+        for attempt in range(self.max_retries):
+            try:
+                # single inserts at row 2 put the newest row on top
+                worksheet.insert_rows(rows[::-1], 2)
+                return
+            except gspread.exceptions.APIError as e:
+                if not self.is_quota_error(e) or \
+                        attempt == self.max_retries - 1:
+                    raise
+                time.sleep(self.backoff_factor * 2 ** attempt)
 
 
 class TargetArchiver(object):
@@ -41,7 +220,9 @@ class TargetArchiver(object):
 
     @property
     def row_with_comment(self):
-        row_with_comment = self.row.append(
+        # the parsed degrees are not part of the archive layout
+        row = self.row.drop(coord_columns, errors='ignore')
+        row_with_comment = row.append(
             pd.Series({'Comment': self.text.value})
         )
         row_with_comment = row_with_comment.append(
@@ -74,46 +255,128 @@ class TargetArchiver(object):
 
 
 class LocalTargetArchiver(TargetArchiver):
+    key = 'archived_targets'
+    # string widths are fixed on the first append to a table
+    index_itemsize = 64
+    string_itemsize = 128
+    comment_itemsize = 1024
+
     def __init__(self, row, archive_path='data/targets_archive.hdf'):
         self.archive_path = archive_path
         super().__init__(row)
 
+    @classmethod
+    def prepare_frame(cls, frame, dtypes=None):
+        frame = frame.infer_objects()
+        frame.index = frame.index.astype(str)
+        dtypes = dtypes if dtypes is not None else {}
+        for column in frame.columns:
+            dtype = dtypes.get(column)
+            if dtype is not None and is_numeric_dtype(dtype) and \
+                    frame[column].dtype != dtype:
+                # match the numeric type already stored in the table
+                try:
+                    frame[column] = pd.to_numeric(frame[column]).astype(dtype)
+                except (ValueError, TypeError):
+                    pass
+            if not is_numeric_dtype(frame[column]) or \
+                    (dtype is not None and not is_numeric_dtype(dtype)):
+                values = frame[column]
+                frame[column] = values.where(values.notnull(), '').astype(str)
+        return frame
+
+    @classmethod
+    def get_min_itemsize(cls, frame):
+        min_itemsize = {'index': cls.index_itemsize}
+        for column in frame.columns:
+            if is_numeric_dtype(frame[column]):
+                continue
+            if column == 'Comment':
+                min_itemsize[column] = cls.comment_itemsize
+            else:
+                min_itemsize[column] = cls.string_itemsize
+        return min_itemsize
+
+    @classmethod
+    def get_table_dtypes(cls, hdf):
+        if '/' + cls.key not in hdf.keys():
+            return None
+        return hdf.select(cls.key, start=0, stop=0).dtypes.to_dict()
+
+    @classmethod
+    def append_to_table(cls, hdf, frame):
+        frame = cls.prepare_frame(frame, cls.get_table_dtypes(hdf))
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            hdf.append(cls.key, frame, format='table',
+                       min_itemsize=cls.get_min_itemsize(frame))
+
+    @classmethod
+    def convert_to_table(cls, hdf):
+        if '/' + cls.key in hdf.keys() and \
+                not hdf.get_storer(cls.key).is_table:
+            archived_targets = hdf[cls.key]
+            hdf.remove(cls.key)
+            cls.append_to_table(hdf, archived_targets)
+
+    @property
+    def registry(self):
+        return LocalArchiveRegistry.get(self.archive_path)
+
     def archive(self):
+        self.registry.add(self.name)
         with pd.HDFStore(self.archive_path) as hdf:
-            if '/archived_targets' not in hdf.keys():
-                archived_targets = self.row_with_comment_frame
-            else:
+            self.convert_to_table(hdf)
+            try:
+                self.append_to_table(hdf, self.row_with_comment_frame)
+            except ValueError:
+                # columns changed, rewrite the table once with the union
                 archived_targets = pd.concat(
-                    [hdf.archived_targets, self.row_with_comment_frame]
+                    [hdf[self.key],
+                     self.prepare_frame(self.row_with_comment_frame)],
+                    sort=False
                 )
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                hdf.put('archived_targets', archived_targets)
+                hdf.remove(self.key)
+                self.append_to_table(hdf, archived_targets)
+
+    @classmethod
+    def read_archived_names(cls, archive_path='data/targets_archive.hdf'):
+        if not os.path.isfile(archive_path):
+            return []
+        with pd.HDFStore(archive_path, mode='r') as hdf:
+            if '/' + cls.key not in hdf.keys():
+                return []
+            if hdf.get_storer(cls.key).is_table:
+                return hdf.select_column(cls.key, 'index').tolist()
+            return hdf[cls.key].index.tolist()
+
+    @classmethod
+    def archived_names(cls, names, archive_path='data/targets_archive.hdf'):
+        return set(names).intersection(cls.read_archived_names(archive_path))
 
     def check_if_archived(self):
-        if os.path.isfile(self.archive_path):
-            with pd.HDFStore(self.archive_path) as hdf:
-                if self.name in hdf['/archived_targets'].index:
-                    self.deactivate_button()
+        if self.name in self.registry:
+            self.deactivate_button()
 
 
 class GspreadTargetArchiver(TargetArchiver):
     json_keyfile_name = None  # is set in __init__.py
-    scope = ['https://spreadsheets.google.com/feeds',
-             'https://www.googleapis.com/auth/drive']
+    spreadsheet = None  # e.g. tests/fake_gspread.FakeSpreadsheet
 
     def __init__(self, row):
-        self.credentials = ServiceAccountCredentials.from_json_keyfile_name(
-            self.json_keyfile_name, self.scope
-        )
-        self.client = gspread.authorize(self.credentials)
-        self.sheet = self.client.open('snII_cosmo_targets_archive')
-        self._gspread_columns = None
+        self.registry = GspreadArchiveRegistry.get(self.json_keyfile_name,
+                                                   self.spreadsheet)
+        self.sheet = self.registry.sheet
         super().__init__(row)
 
     def archive(self):
+        self.registry.add(self.name)
         row = self.row_with_comment.astype(str).to_list()
-        self.sheet.worksheet(self.destination.value).insert_row(row, 2)
+        self.registry.write_queue.put(self.destination.value, row)
+
+    def check_if_archived(self):
+        if self.name in self.registry:
+            self.deactivate_button()
 
     @property
     def archived_objects(self):
@@ -125,9 +388,7 @@ class GspreadTargetArchiver(TargetArchiver):
 
     @property
     def gspread_columns(self):
-        if not self._gspread_columns:
-            self._gspread_columns = self.sheet.sheet1.row_values(1)
-        return self._gspread_columns
+        return self.registry.columns
 
     @staticmethod
     def get_name_from_href(html_refs):
@@ -136,3 +397,4 @@ class GspreadTargetArchiver(TargetArchiver):
                               'html.parser').text for html_ref in html_refs
         ]
         return names
+
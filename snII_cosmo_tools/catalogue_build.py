@@ -0,0 +1,45 @@
+import os
+import argparse
+import pandas as pd
+from .redshift import catalogue_classes
+from .catalogue_io import write_columnar_catalogue
+
+
+def build_catalogue(catalogue_class, fname, dest, dtype='float64',
+                    pixel_size=1.):
+    with pd.HDFStore(fname, mode='r') as store:
+        data = store['data']
+        description = None
+        if '/description' in store.keys():
+            description = store['description']
+    coords = catalogue_class.get_sky_coords(data)
+    meta = {'catalogue': catalogue_class.short_name,
+            'source': os.path.abspath(fname)}
+    write_columnar_catalogue(data, coords.ra.deg, coords.dec.deg, dest,
+                             dtype=dtype, pixel_size=pixel_size,
+                             description=description, meta=meta)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Convert a redshift catalogue HDF file into the '
+                    'columnar format read by RedshiftCatalogue.'
+    )
+    parser.add_argument('catalogue', choices=sorted(catalogue_classes),
+                        help='catalogue the input file belongs to')
+    parser.add_argument('input', help='pandas HDF file of the catalogue')
+    parser.add_argument('output', help='destination directory')
+    parser.add_argument('--float32', action='store_true',
+                        help='store coordinates in single precision')
+    parser.add_argument('--pixel-size', type=float, default=1.,
+                        help='sky pixel size in degrees used for sorting')
+    args = parser.parse_args(argv)
+
+    dtype = 'float32' if args.float32 else 'float64'
+    print('Building {} from {}'.format(args.output, args.input))
+    build_catalogue(catalogue_classes[args.catalogue], args.input,
+                    args.output, dtype=dtype, pixel_size=args.pixel_size)
+
+
+if __name__ == '__main__':
+    main()
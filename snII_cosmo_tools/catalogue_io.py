@@ -0,0 +1,159 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+
+
+class HDFCatalogueReader(object):
+    def __init__(self, fname, key='data'):
+        self.fname = fname
+        self.key = key
+        self._rows = None
+        self._data = None
+
+    @property
+    def description(self):
+        with pd.HDFStore(self.fname, mode='r') as store:
+            if '/description' in store.keys():
+                return store['description']
+
+    @property
+    def is_table(self):
+        with pd.HDFStore(self.fname, mode='r') as store:
+            return store.get_storer(self.key).is_table
+
+    @property
+    def supports_lazy(self):
+        return self._data is None
+
+    def select_rows(self, store, min_z, max_z):
+        try:
+            rows = store.select_as_coordinates(
+                self.key, where='z > {!r} & z < {!r}'.format(min_z, max_z)
+            )
+            return np.asarray(rows)
+        except ValueError:
+            # z is not a data column, so it can't be queried on disk
+            z = store.select(self.key, columns=['z']).z.values
+            return np.flatnonzero((z > min_z) & (z < max_z))
+
+    def read(self, min_z, max_z, columns=None):
+        with pd.HDFStore(self.fname, mode='r') as store:
+            if store.get_storer(self.key).is_table:
+                self._rows = self.select_rows(store, min_z, max_z)
+                return self.select(store, self._rows, columns=columns)
+            data = store[self.key]
+        # fixed format stores can only be read as a whole
+        self._data = data[(data.z > min_z) & (data.z < max_z)]
+        return self._data
+
+    def select(self, store, rows, columns=None):
+        if len(rows) == 0:
+            return store.select(self.key, start=0, stop=0, columns=columns)
+        return store.select(self.key, where=rows, columns=columns)
+
+    def fetch(self, positions):
+        positions = np.asarray(positions, dtype=int)
+        if self._data is not None:
+            return self._data.iloc[positions]
+        unique_positions, inverse = np.unique(positions, return_inverse=True)
+        with pd.HDFStore(self.fname, mode='r') as store:
+            data = self.select(store, self._rows[unique_positions])
+        return data.iloc[inverse]
+
+
+class ColumnarCatalogueReader(HDFCatalogueReader):
+    columns_fname = 'columns.hdf'
+    meta_fname = 'meta.json'
+    degree_columns = ['ra_deg', 'dec_deg']
+
+    def __init__(self, path):
+        super().__init__(os.path.join(path, self.columns_fname))
+        self.path = path
+        self._arrays = None
+
+    @property
+    def meta(self):
+        with open(os.path.join(self.path, self.meta_fname)) as f:
+            return json.load(f)
+
+    @property
+    def supports_lazy(self):
+        return True
+
+    def load_array(self, name):
+        return np.load(os.path.join(self.path, name + '.npy'), mmap_mode='r')
+
+    def read(self, min_z, max_z, columns=None):
+        z = self.load_array('z')
+        self._rows = np.flatnonzero((z > min_z) & (z < max_z))
+        self._arrays = pd.DataFrame({
+            'z': z[self._rows],
+            'ra_deg': self.load_array('ra')[self._rows].astype(np.float64),
+            'dec_deg': self.load_array('dec')[self._rows].astype(np.float64)
+        })
+        if columns is not None:
+            return self._arrays
+        with pd.HDFStore(self.fname, mode='r') as store:
+            data = self.select(store, self._rows)
+        return self.join_degree_columns(data, np.arange(len(data)))
+
+    def join_degree_columns(self, data, positions):
+        data = data.copy()
+        for column in self.degree_columns:
+            data[column] = self._arrays[column].values[positions]
+        return data
+
+    def fetch(self, positions):
+        positions = np.asarray(positions, dtype=int)
+        data = super().fetch(positions)
+        return self.join_degree_columns(data, positions)
+
+
+def open_catalogue_reader(fname):
+    if os.path.isdir(fname):
+        return ColumnarCatalogueReader(fname)
+    return HDFCatalogueReader(fname)
+
+
+def get_sky_pixels(ra, dec, pixel_size=1.):
+    # equal-area dec bands split into ra bins of ~pixel_size degrees
+    num_bands = int(np.ceil(180. / pixel_size))
+    sin_dec = np.sin(np.radians(dec))
+    band = np.minimum(((sin_dec + 1.) / 2. * num_bands).astype(np.int64),
+                      num_bands - 1)
+    num_ra_bins = int(np.ceil(360. / pixel_size))
+    ra_bin = np.minimum((np.mod(ra, 360.) / 360. * num_ra_bins).astype(
+        np.int64), num_ra_bins - 1)
+    return band * num_ra_bins + ra_bin
+
+
+def write_columnar_catalogue(data, ra, dec, dest, dtype='float64',
+                             pixel_size=1., description=None, meta=None):
+    if not os.path.isdir(dest):
+        os.makedirs(dest)
+    pixels = get_sky_pixels(ra, dec, pixel_size)
+    order = np.argsort(pixels, kind='mergesort')
+    data = data.iloc[order]
+    np.save(os.path.join(dest, 'ra.npy'), np.asarray(ra, dtype=dtype)[order])
+    np.save(os.path.join(dest, 'dec.npy'),
+            np.asarray(dec, dtype=dtype)[order])
+    np.save(os.path.join(dest, 'z.npy'),
+            data.z.values.astype(np.float64))
+    np.save(os.path.join(dest, 'pixel.npy'), pixels[order])
+
+    data = data.copy()
+    for column in data.columns[data.dtypes == object]:
+        data[column] = data[column].fillna('').astype(str)
+    columns_fname = os.path.join(dest, ColumnarCatalogueReader.columns_fname)
+    with pd.HDFStore(columns_fname, mode='w') as store:
+        store.put('data', data, format='table', data_columns=['z'])
+        if description is not None:
+            store.put('description', description)
+
+    meta = dict(meta or {})
+    meta.update({'num_rows': len(data), 'dtype': dtype,
+                 'pixel_size': pixel_size, 'columns': list(data.columns)})
+    with open(os.path.join(dest, ColumnarCatalogueReader.meta_fname),
+              'w') as f:
+        json.dump(meta, f, indent=2)
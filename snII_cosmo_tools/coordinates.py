@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+import astropy.units as u
+from astropy.coordinates import SkyCoord
+
+coord_columns = ['ra_deg', 'dec_deg']
+
+
+def sexagesimal_to_degrees(values, scale=1.):
+    if len(values) == 0:
+        return np.array([], dtype=float)
+    values = pd.Series(values).astype(str).str.strip()
+    sign = np.where(values.str.startswith('-'), -1., 1.)
+    parts = values.str.lstrip('+-').str.split(':', expand=True)
+    parts = parts.apply(pd.to_numeric, errors='coerce')
+    degrees = parts[0].values.astype(float)
+    for i in range(1, min(parts.shape[1], 3)):
+        degrees = degrees + parts[i].fillna(0.).values / 60. ** i
+    return sign * degrees * scale
+
+
+def get_coord_arrays_from_frame(df):
+    if all(column in df.columns for column in coord_columns):
+        return df.ra_deg.values, df.dec_deg.values
+    ra = sexagesimal_to_degrees(df.RA.values, scale=15.)
+    dec = sexagesimal_to_degrees(df.DEC.values)
+    return ra, dec
+
+
+def get_sky_coords_from_frame(df):
+    ra, dec = get_coord_arrays_from_frame(df)
+    return SkyCoord(ra, dec, unit=u.deg)
+
+
+def get_sky_coord_from_row(row):
+    if all(column in row.index for column in coord_columns):
+        return SkyCoord(row.ra_deg, row.dec_deg, unit=u.deg)
+    return SkyCoord(row.RA, row.DEC, unit=(u.hourangle, u.deg))
+
+
+def insert_coords_in_frame(df):
+    ra, dec = get_coord_arrays_from_frame(df)
+    df = df.copy()
+    for column, values in zip(coord_columns, [ra, dec]):
+        if column not in df.columns:
+            df.insert(len(df.columns), column, values)
+    return df
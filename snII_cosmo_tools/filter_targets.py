@@ -1,39 +1,87 @@
 import numpy as np
+import pandas as pd
+from collections import OrderedDict
 from ipywidgets import ToggleButtons, FloatSlider, interactive
-from snII_cosmo_tools.style import get_styled_html_table
+from snII_cosmo_tools.style import get_styled_html_table, get_table_styles
 from IPython.display import display, HTML
 
 
+class SortedColumnIndex(object):
+    def __init__(self, values):
+        values = np.asarray(values, dtype=float)
+        # NaNs never pass a threshold, so they are left out of the index
+        finite = np.flatnonzero(~np.isnan(values))
+        order = np.argsort(values[finite], kind='mergesort')
+        self.size = len(values)
+        self.positions = finite[order]
+        self.sorted_values = values[self.positions]
+
+    def greater_than(self, threshold):
+        start = np.searchsorted(self.sorted_values, threshold, side='right')
+        mask = np.zeros(self.size, dtype=bool)
+        mask[self.positions[start:]] = True
+        return mask
+
+
 class TargetFilter(object):
+    max_cached_results = 128
+
     def __init__(self, targets):
         self.targets = targets
+        self.alt_index = SortedColumnIndex(targets.max_alt.values)
+        self.mag_index = SortedColumnIndex(targets['Discovery Mag'].values)
+        obj_types = targets['Obj. Type'].where(
+            [isinstance(obj_type, str) for obj_type in targets['Obj. Type']]
+        )
+        # unclassified objects get the code -1
+        self.obj_codes, self.obj_categories = pd.factorize(obj_types)
+        self.styles = get_table_styles(targets)
+        self._results = OrderedDict()
+
+    def get_obj_mask(self, obj_type):
+        if obj_type == 'unclassified':
+            return self.obj_codes == -1
+        if obj_type not in self.obj_categories:
+            return np.zeros(len(self.obj_codes), dtype=bool)
+        return self.obj_codes == self.obj_categories.get_loc(obj_type)
+
+    def get_result(self, obj_type, max_alt, mag_cut):
+        key = (obj_type, max_alt, mag_cut)
+        if key in self._results:
+            self._results.move_to_end(key)
+            return self._results[key]
+
+        mask_alt = self.alt_index.greater_than(max_alt)
+        mask_mag = self.mag_index.greater_than(mag_cut)
+        mask_obj = self.get_obj_mask(obj_type)
+        mask = mask_alt & mask_mag & mask_obj
+
+        N_alt = len(mask) - mask_alt.sum()
+        N_mag = len(mask) - mask_mag.sum()
+        N_obj = len(mask) - mask_obj.sum()
+        counts = (N_alt, N_mag, N_obj)
+
+        filtered = self.targets[mask]
+        html = get_styled_html_table(filtered, styles=self.styles[mask])
+
+        self._results[key] = (mask, counts, filtered, html)
+        if len(self._results) > self.max_cached_results:
+            self._results.popitem(last=False)
+        return self._results[key]
 
     def filter_targets(self, obj_type, max_alt, mag_cut):
-        mask_alt = self.targets.max_alt > max_alt
-        mask_mag = self.targets['Discovery Mag'] > mag_cut
-        mask_classified = [
-            isinstance(obj_type, str) for obj_type in self.targets['Obj. Type']
-        ]
-        if obj_type != 'unclassified':
-            mask_obj = self.targets['Obj. Type'] == obj_type
-        else:
-            mask_obj = np.logical_not(mask_classified)
-
-        mask = np.logical_and(mask_alt, mask_mag)
-        mask = np.logical_and(mask, mask_obj)
-
-        N_alt = np.logical_not(mask_alt).sum()
-        N_mag = np.logical_not(mask_mag).sum()
-        N_obj = np.logical_not(mask_obj).sum()
+        mask, (N_alt, N_mag, N_obj), filtered, html = self.get_result(
+            obj_type, max_alt, mag_cut
+        )
         N_tot = N_alt + N_mag + N_obj
 
         print('Discarding {} objects: {} based on mag, {} based on alt, {} based on type'.format(
             N_tot, N_mag, N_alt, N_obj)
         )
 
-        display(HTML(get_styled_html_table(self.targets[mask])))
+        display(HTML(html))
 
-        return self.targets[mask]
+        return filtered
 
 
 class InteractiveTargetFilter(TargetFilter):
@@ -0,0 +1,239 @@
+import json
+import time
+import hashlib
+import zipfile
+import threading
+import requests
+import pandas as pd
+from datetime import datetime
+from contextlib import contextmanager
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.util.retry import Retry
+from urllib.parse import urlsplit, urlunsplit
+
+
+class TokenBucket(object):
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity else max(1., rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity,
+                                  self.tokens + (now - self.updated) *
+                                  self.rate)
+                self.updated = now
+                if self.tokens >= 1.:
+                    self.tokens -= 1.
+                    return
+                wait = (1. - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class ReplayError(Exception):
+    pass
+
+
+class ResponseArchive(object):
+    recording_fname = 'recording.json'
+    time_format = '%Y-%m-%d %H:%M:%S'
+
+    def __init__(self, path, mode='r'):
+        self.path = path
+        self.zipfile = zipfile.ZipFile(path, mode,
+                                       compression=zipfile.ZIP_DEFLATED)
+        names = self.zipfile.namelist()
+        self.keys = set(name.rsplit('.', 1)[0] for name in names
+                        if name != self.recording_fname)
+        self.lock = threading.Lock()
+        # queries built from the current date are replayed with the date
+        # of the recording
+        self.recorded_at = None
+        if self.recording_fname in names:
+            recording = json.loads(
+                self.zipfile.read(self.recording_fname).decode())
+            self.recorded_at = datetime.strptime(recording['recorded_at'],
+                                                 self.time_format)
+        elif mode != 'r':
+            self.recorded_at = datetime.now().replace(microsecond=0)
+            self.zipfile.writestr(self.recording_fname, json.dumps({
+                'recorded_at': self.recorded_at.strftime(self.time_format)
+            }))
+
+    @staticmethod
+    def get_key(url, params=None):
+        url = requests.Request('GET', url, params=params).prepare().url
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def store(self, key, response):
+        meta = {'url': response.url, 'status_code': response.status_code,
+                'reason': response.reason, 'encoding': response.encoding,
+                'headers': dict(response.headers)}
+        with self.lock:
+            if key in self.keys:
+                return
+            self.zipfile.writestr(key + '.json', json.dumps(meta))
+            self.zipfile.writestr(key + '.body', response.content)
+            self.keys.add(key)
+
+    def load(self, key):
+        with self.lock:
+            if key not in self.keys:
+                raise ReplayError(
+                    'No recorded response in {}'.format(self.path))
+            meta = json.loads(self.zipfile.read(key + '.json').decode())
+            content = self.zipfile.read(key + '.body')
+        response = requests.Response()
+        response.url = meta['url']
+        response.status_code = meta['status_code']
+        response.reason = meta['reason']
+        response.encoding = meta['encoding']
+        response.headers = CaseInsensitiveDict(meta['headers'])
+        response._content = content
+        return response
+
+    def close(self):
+        with self.lock:
+            self.zipfile.close()
+
+
+class HostStats(object):
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.total_latency = 0.
+
+    @property
+    def mean_latency(self):
+        if self.requests == 0:
+            return 0.
+        return self.total_latency / self.requests
+
+
+class HTTPClient(object):
+    retry_status = [429, 500, 502, 503, 504]
+
+    def __init__(self, timeout=30., retries=3, backoff_factor=0.5,
+                 rate_limits=None, pool_maxsize=16, host_overrides=None):
+        self.timeout = timeout
+        self.rate_limits = dict(rate_limits or {})
+        self.host_overrides = dict(host_overrides or {})
+        self.session = requests.Session()
+        retry = Retry(total=retries, backoff_factor=backoff_factor,
+                      status_forcelist=self.retry_status)
+        adapter = HTTPAdapter(max_retries=retry, pool_maxsize=pool_maxsize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._buckets = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+        self.mode = 'live'
+        self.archive = None
+
+    def get_bucket(self, host):
+        with self._lock:
+            if host not in self._buckets and host in self.rate_limits:
+                self._buckets[host] = TokenBucket(self.rate_limits[host])
+            return self._buckets.get(host)
+
+    def get_host_stats(self, host):
+        with self._lock:
+            if host not in self._stats:
+                self._stats[host] = HostStats()
+            return self._stats[host]
+
+    def resolve(self, url):
+        # redirects a host to e.g. a local mock server
+        parts = urlsplit(url)
+        if parts.netloc not in self.host_overrides:
+            return url
+        override = urlsplit(self.host_overrides[parts.netloc])
+        return urlunsplit((override.scheme, override.netloc,
+                           override.path.rstrip('/') + parts.path,
+                           parts.query, parts.fragment))
+
+    def record(self, path):
+        self.stop()
+        self.archive = ResponseArchive(path, mode='a')
+        self.mode = 'record'
+
+    def replay(self, path):
+        self.stop()
+        self.archive = ResponseArchive(path, mode='r')
+        self.mode = 'replay'
+
+    def stop(self):
+        if self.archive is not None:
+            self.archive.close()
+        self.archive = None
+        self.mode = 'live'
+
+    def now(self):
+        if self.mode == 'replay' and self.archive.recorded_at is not None:
+            return self.archive.recorded_at
+        return datetime.now()
+
+    @contextmanager
+    def recording(self, path):
+        self.record(path)
+        try:
+            yield self
+        finally:
+            self.stop()
+
+    @contextmanager
+    def replaying(self, path):
+        self.replay(path)
+        try:
+            yield self
+        finally:
+            self.stop()
+
+    def get(self, url, params=None, **kwargs):
+        if self.mode == 'replay':
+            return self.archive.load(ResponseArchive.get_key(url, params))
+        response = self.request(url, params=params, **kwargs)
+        if self.mode == 'record':
+            self.archive.store(ResponseArchive.get_key(url, params),
+                               response)
+        return response
+
+    def request(self, url, params=None, **kwargs):
+        host = urlsplit(url).netloc
+        bucket = self.get_bucket(host)
+        if bucket is not None:
+            bucket.acquire()
+        kwargs.setdefault('timeout', self.timeout)
+        stats = self.get_host_stats(host)
+        start = time.monotonic()
+        try:
+            return self.session.get(self.resolve(url), params=params,
+                                    **kwargs)
+        except requests.RequestException:
+            with self._lock:
+                stats.errors += 1
+            raise
+        finally:
+            with self._lock:
+                stats.requests += 1
+                stats.total_latency += time.monotonic() - start
+
+    @property
+    def stats(self):
+        with self._lock:
+            return pd.DataFrame(
+                [[s.requests, s.errors, s.mean_latency]
+                 for s in self._stats.values()],
+                index=list(self._stats.keys()),
+                columns=['requests', 'errors', 'mean_latency']
+            )
+
+
+client = HTTPClient(rate_limits={'wis-tns.weizmann.ac.il': 2.,
+                                 'lasair.roe.ac.uk': 5.})
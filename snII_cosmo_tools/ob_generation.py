@@ -1,8 +1,12 @@
 import re
 import os
-from astropy import units as u
-from astropy.coordinates import SkyCoord
+import io
+import gzip
+import json
+import tarfile
+import zipfile
 from .tns_downloader import TNSObjectDownloader
+from .coordinates import get_sky_coord_from_row, get_sky_coords_from_frame
 
 
 class Magnitude(object):
@@ -41,8 +45,147 @@ class Magnitude(object):
         return brightness_category
 
 
+class OBTemplate(object):
+    value_regex = re.compile(r'(?<=")(?P<name>\S*)(?=")')
+    keys = ['TARGET.NAME', 'name', 'ra', 'dec', 'userComments']
+    _templates = {}
+
+    def __init__(self, lines):
+        # alternating literal text and the keys of the values in between
+        self.literals = []
+        self.slots = []
+        literal = ''
+        for line in lines:
+            key = self.match_key(line)
+            if key is None:
+                literal += line
+                continue
+            start = 0
+            for match in self.value_regex.finditer(line):
+                self.literals.append(literal + line[start:match.start()])
+                self.slots.append(key)
+                literal = ''
+                start = match.end()
+            literal += line[start:]
+        self.literals.append(literal)
+
+    @classmethod
+    def match_key(cls, line):
+        for key in cls.keys:
+            if re.match(key + r'\s+', line):
+                return key
+
+    @classmethod
+    def from_file(cls, fname):
+        mtime = os.path.getmtime(fname)
+        if fname not in cls._templates or cls._templates[fname][0] != mtime:
+            with open(fname) as f:
+                cls._templates[fname] = (mtime, cls(f.readlines()))
+        return cls._templates[fname][1]
+
+    def render(self, values):
+        parts = [self.literals[0]]
+        for key, literal in zip(self.slots, self.literals[1:]):
+            parts.append(values[key])
+            parts.append(literal)
+        return ''.join(parts)
+
+
+class OBBundle(object):
+    manifest_fname = 'manifest.json'
+    # fixed timestamps so that regenerating a bundle gives the same bytes
+    date_time = (1980, 1, 1, 0, 0, 0)
+    formats = ['zip', 'tar', 'tar.gz']
+
+    def __init__(self, sink, archive_format=None):
+        if archive_format is None:
+            archive_format = self.get_format(sink)
+        if archive_format not in self.formats:
+            raise ValueError(
+                'Unknown archive format {!r}, use one of {}'.format(
+                    archive_format, self.formats)
+            )
+        self.sink = sink
+        self.archive_format = archive_format
+        self.obs = {}
+        self.manifest = []
+
+    @staticmethod
+    def get_format(sink):
+        if isinstance(sink, str):
+            if sink.endswith(('.tar.gz', '.tgz')):
+                return 'tar.gz'
+            if sink.endswith('.tar'):
+                return 'tar'
+        return 'zip'
+
+    def add(self, generator):
+        if generator.ob_fname in self.obs:
+            raise ValueError(
+                'The bundle already contains an OB named {}'.format(
+                    generator.ob_fname)
+            )
+        self.obs[generator.ob_fname] = generator.render_ob().encode('utf-8')
+        self.manifest.append({
+            'fname': generator.ob_fname,
+            'target_name': generator.target_name,
+            'ob_name': generator.ob_name,
+            'ra': generator.ra,
+            'dec': generator.dec,
+            'magnitude': generator.magnitude.ob_user_comment,
+            'brightness_category': generator.magnitude.brightness_category,
+            'template': os.path.basename(generator.template_ob)
+        })
+
+    @property
+    def members(self):
+        manifest = sorted(self.manifest, key=lambda entry: entry['fname'])
+        members = [(self.manifest_fname,
+                    json.dumps(manifest, indent=2, sort_keys=True).encode())]
+        members += sorted(self.obs.items())
+        return members
+
+    def write(self):
+        if isinstance(self.sink, str):
+            with open(self.sink, 'wb') as f:
+                self.write_to(f)
+        else:
+            self.write_to(self.sink)
+
+    def write_to(self, f):
+        if self.archive_format == 'zip':
+            with zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED) as archive:
+                for fname, content in self.members:
+                    info = zipfile.ZipInfo(fname, date_time=self.date_time)
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                    info.external_attr = 0o644 << 16
+                    archive.writestr(info, content)
+        elif self.archive_format == 'tar.gz':
+            with gzip.GzipFile(filename='', mode='wb', fileobj=f,
+                               mtime=0) as gz:
+                self.write_tar(gz)
+        else:
+            self.write_tar(f)
+
+    def write_tar(self, f):
+        with tarfile.open(fileobj=f, mode='w',
+                          format=tarfile.PAX_FORMAT) as archive:
+            for fname, content in self.members:
+                info = tarfile.TarInfo(fname)
+                info.size = len(content)
+                info.mode = 0o644
+                archive.addfile(info, io.BytesIO(content))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.write()
+
+
 class OBGenerator(object):
-    value_regex = re.compile('(?<=\")(?P<name>\S*)(?=\")') # noqa
+    template_path = 'data/template_obs/ob_classification_{}.obx'
 
     def __init__(self, target_name, coords, magnitude,
                  template_ob='data/template_obs/ob_classification_faint.obx',
@@ -54,13 +197,14 @@ class OBGenerator(object):
         self.dest_path = dest_path
         self.template_ob = template_ob
         self.suffix = suffix
+        self._hmsdms = None
 
     @classmethod
     def from_row(cls, row,
                  template_ob='data/template_obs/ob_classification_faint.obx',
                  suffix=''):
         target_name = row.name
-        coords = SkyCoord(row.RA, row.DEC, unit=(u.hourangle, u.deg))
+        coords = get_sky_coord_from_row(row)
         magnitude = Magnitude.from_row(row)
         return cls(target_name, coords, magnitude, template_ob, suffix=suffix)
 
@@ -71,22 +215,56 @@ class OBGenerator(object):
         row = TNSObjectDownloader(name).series
         return cls.from_row(row, template_ob, suffix)
 
+    @classmethod
+    def from_frame(cls, frame, dest_path='data/generated_obs',
+                   prefix='TOO_', suffix=''):
+        coords = get_sky_coords_from_frame(frame)
+        hmsdms = coords.to_string('hmsdms', sep=':')
+        generators = []
+        for i, (name, value, band) in enumerate(zip(
+                frame.index, frame['Discovery Mag'].values,
+                frame['Discovery Mag Filter'].values)):
+            magnitude = Magnitude(value, band)
+            template_ob = cls.template_path.format(
+                magnitude.brightness_category
+            )
+            generator = cls(name, coords[i], magnitude, template_ob,
+                            prefix=prefix, dest_path=dest_path,
+                            suffix=suffix)
+            generator._hmsdms = hmsdms[i].split(' ')
+            generators.append(generator)
+        return generators
+
+    @classmethod
+    def generate_obs(cls, frame, dest_path='data/generated_obs',
+                     prefix='TOO_', suffix=''):
+        generators = cls.from_frame(frame, dest_path, prefix, suffix)
+        for generator in generators:
+            generator.generate_ob()
+        return generators
+
+    @classmethod
+    def export_obs(cls, frame, sink, archive_format=None, prefix='TOO_',
+                   suffix=''):
+        generators = cls.from_frame(frame, prefix=prefix, suffix=suffix)
+        with OBBundle(sink, archive_format) as bundle:
+            for generator in generators:
+                bundle.add(generator)
+        return generators
+
+    @property
+    def hmsdms(self):
+        if self._hmsdms is None:
+            self._hmsdms = self.coords.to_string('hmsdms', sep=':').split(' ')
+        return self._hmsdms
+
     @property
     def ra(self):
-        return self.coords.to_string('hmsdms', sep=':').split(' ')[0]
+        return self.hmsdms[0]
 
     @property
     def dec(self):
-        dec = self.coords.to_string('hmsdms', sep=':').split(' ')[1]
-        return dec.replace('+', '')
-
-    @classmethod
-    def set_value(cls, ob, key, value):
-        return [
-            re.sub(cls.value_regex,
-                   value, line) if re.match(key + '\s+',
-                                            line) else line for line in ob
-        ]
+        return self.hmsdms[1].replace('+', '')
 
     @property
     def ob_fname(self):
@@ -103,24 +281,26 @@ class OBGenerator(object):
         )
         return name
 
-    def generate_ob(self, ob_file=None):
-        with open(self.template_ob) as f:
-            ob = f.readlines()
+    @property
+    def ob_values(self):
+        return {'TARGET.NAME': self.target_name, 'name': self.ob_name,
+                'ra': self.ra, 'dec': self.dec,
+                'userComments': self.magnitude.ob_user_comment}
 
-        ob = self.set_value(ob, 'TARGET.NAME', self.target_name)
-        ob = self.set_value(ob, 'name', self.ob_name)
-        ob = self.set_value(ob, 'ra', self.ra)
-        ob = self.set_value(ob, 'dec', self.dec)
-        ob = self.set_value(ob, 'userComments', self.magnitude.ob_user_comment)
+    def render_ob(self):
+        return OBTemplate.from_file(self.template_ob).render(self.ob_values)
+
+    def generate_ob(self, ob_file=None):
+        ob = self.render_ob()
 
         if ob_file:
-            ob_file.writelines(ob)
+            ob_file.write(ob)
         else:
             if not os.path.isdir(self.dest_path):
-                os.mkdir(self.dest_path)
+                os.makedirs(self.dest_path)
 
             with open(os.path.join(self.dest_path, self.ob_fname), 'w+') as f:
-                f.writelines(ob)
+                f.write(ob)
 
     def __call__(self, button):
         self.generate_ob()
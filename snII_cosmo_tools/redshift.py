@@ -1,42 +1,263 @@
+import os
+import json
+import hashlib
 import numpy as np
 import pandas as pd
 import astropy.units as units
 import matplotlib.pyplot as plt
+from scipy.spatial import cKDTree
 from astropy.cosmology import Planck15
-from astropy.coordinates import SkyCoord
 from astropy.table import Table, hstack
+from .catalogue_io import open_catalogue_reader
+from .coordinates import get_sky_coords_from_frame, get_sky_coord_from_row
+from astropy.coordinates import (SkyCoord, CartesianRepresentation,
+                                 UnitSphericalRepresentation)
+
+
+class DistmodInterpolator(object):
+    def __init__(self, cosmology=Planck15, min_z=1e-4, max_z=3.,
+                 num=2000):
+        self.cosmology = cosmology
+        self.min_z = min_z
+        self.max_z = max_z
+        self.num = num
+        self._log_z_grid = None
+        self._distmod_grid = None
+
+    def build_grid(self):
+        z_grid = np.geomspace(self.min_z, self.max_z, self.num)
+        self._log_z_grid = np.log(z_grid)
+        self._distmod_grid = self.cosmology.distmod(z_grid).value
+
+    def __call__(self, z):
+        if self._distmod_grid is None:
+            self.build_grid()
+        z = np.atleast_1d(np.asarray(z, dtype=float))
+        distmod = np.full(z.shape, np.nan)
+        in_grid = (z >= self.min_z) & (z <= self.max_z)
+        distmod[in_grid] = np.interp(np.log(z[in_grid]), self._log_z_grid,
+                                     self._distmod_grid)
+        off_grid = np.logical_not(in_grid) & np.isfinite(z)
+        if off_grid.any():
+            distmod[off_grid] = self.cosmology.distmod(z[off_grid]).value
+        return distmod
+
+
+distmod = DistmodInterpolator()
+
+
+def get_catalogue_files(fname):
+    if os.path.isdir(fname):
+        return [os.path.join(fname, name)
+                for name in sorted(os.listdir(fname))]
+    return [fname]
+
+
+def get_file_signature(fname):
+    signature = []
+    for fname in get_catalogue_files(fname):
+        stat = os.stat(fname)
+        signature.append([os.path.basename(fname), stat.st_size,
+                          stat.st_mtime_ns])
+    return signature
+
+
+def get_file_hash(fname, chunk_size=2**20):
+    file_hash = hashlib.sha1()
+    for fname in get_catalogue_files(fname):
+        with open(fname, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                file_hash.update(chunk)
+    return file_hash.hexdigest()
 
 
 class RedshiftCatalogue(object):
     comp_repr = slice(None)
+    coord_columns = ['RA', 'dec']
+    derivatives_suffix = '.derived.npz'
+
+    def __init__(self, fname, min_z=1e-2, max_z=0.5, use_cache=True,
+                 lazy=False, full_hash=False):
+        self.fname = fname
+        self.min_z = min_z
+        self.max_z = max_z
+        self.reader = open_catalogue_reader(fname)
+        self.data_description = self.reader.description
+        columns = None
+        if lazy:
+            columns = ['z'] + self.coord_columns
+        self.data = self.reader.read(min_z, max_z, columns=columns)
+        self.lazy = lazy and self.reader.supports_lazy
+        if lazy and not self.lazy:
+            print('{} is not stored in table format. '
+                  'Loading the full catalogue.'.format(fname))
 
-    def __init__(self, fname, min_z=1e-2, max_z=0.5):
-        self.data = pd.HDFStore(fname, mode='r').data
-        self.data_description = pd.HDFStore(fname, mode='r').description
-        self.data = self.data[self.data.z > min_z]
-        self.data = self.data[self.data.z < max_z]
-        self.coords = self.get_sky_coords(self.data)
-        self.arcsec_per_kpc = Planck15.arcsec_per_kpc_proper(self.data.z)
+        derivatives = None
+        if use_cache:
+            self.derivatives_key = self.get_derivatives_key(full_hash)
+            derivatives = self.load_derivatives()
+        if derivatives is None:
+            derivatives = self.compute_derivatives()
+            if use_cache:
+                self.save_derivatives(derivatives)
+
+        self.unit_vectors = derivatives['unit_vectors']
+        self.arcsec_per_kpc = (derivatives['arcsec_per_kpc'] *
+                               units.arcsec / units.kpc)
+        self.distmod = derivatives['distmod']
+        self.coords = SkyCoord(
+            CartesianRepresentation(self.unit_vectors.T).represent_as(
+                UnitSphericalRepresentation),
+            frame='icrs'
+        )
+        self.tree = cKDTree(self.unit_vectors)
+
+    @staticmethod
+    def get_unit_vectors(coords):
+        return coords.icrs.cartesian.xyz.value.T
+
+    @property
+    def derivatives_fname(self):
+        return os.path.normpath(self.fname) + self.derivatives_suffix
+
+    def get_derivatives_key(self, full_hash=False):
+        # size and mtime are cheap, hashing the whole catalogue is opt-in
+        if full_hash:
+            file_key = get_file_hash(self.fname)
+        else:
+            file_key = get_file_signature(self.fname)
+        return json.dumps({
+            'file': file_key,
+            'coord_columns': self.coord_columns,
+            'cosmology': repr(Planck15),
+            'min_z': self.min_z,
+            'max_z': self.max_z
+        }, sort_keys=True)
+
+    def compute_derivatives(self):
+        return {
+            'unit_vectors': self.get_unit_vectors(
+                self.get_frame_sky_coords(self.data)),
+            'arcsec_per_kpc': Planck15.arcsec_per_kpc_proper(
+                self.data.z.values).value,
+            'distmod': Planck15.distmod(self.data.z.values).value
+        }
+
+    def load_derivatives(self):
+        if not os.path.isfile(self.derivatives_fname):
+            return None
+        with np.load(self.derivatives_fname) as cached:
+            if str(cached['key']) != self.derivatives_key:
+                return None
+            derivatives = {
+                name: cached[name] for name in ['unit_vectors',
+                                                'arcsec_per_kpc', 'distmod']
+            }
+        if len(derivatives['distmod']) != len(self.data):
+            return None
+        return derivatives
+
+    def save_derivatives(self, derivatives):
+        try:
+            with open(self.derivatives_fname, 'wb') as f:
+                np.savez(f, key=np.array(self.derivatives_key),
+                         **derivatives)
+        except (IOError, OSError):
+            print('Could not write catalogue cache {}'.format(
+                self.derivatives_fname))
+
+    @property
+    def max_arcsec_per_kpc(self):
+        # The angular scale decreases monotonically with z for z < 1.6,
+        # so the scale at min_z bounds the separation of every galaxy.
+        max_arcsec_per_kpc = Planck15.arcsec_per_kpc_proper(self.min_z).value
+        if len(self.arcsec_per_kpc) > 0:
+            max_arcsec_per_kpc = max(max_arcsec_per_kpc,
+                                     self.arcsec_per_kpc.value.max())
+        return max_arcsec_per_kpc
+
+    def search_radius(self, max_dist_kpc):
+        max_sep = (max_dist_kpc * self.max_arcsec_per_kpc * units.arcsec)
+        max_sep = min(max_sep.to(units.rad).value, np.pi)
+        # chord length on the unit sphere, padded against rounding
+        return 2. * np.sin(0.5 * max_sep) * (1. + 1e-8) + 1e-12
+
+    def find_candidates(self, target_coords, max_dist_kpc=20.):
+        target_vector = self.get_unit_vectors(target_coords)
+        candidates = self.tree.query_ball_point(
+            target_vector, self.search_radius(max_dist_kpc)
+        )
+        return np.sort(np.array(candidates, dtype=int))
 
     @staticmethod
     def get_sky_coords(data):
         return SkyCoord(data.RA, data.dec,
                         frame="icrs", unit=units.deg)
 
+    @classmethod
+    def get_frame_sky_coords(cls, data):
+        # columnar catalogues carry pre-parsed degree coordinates
+        if 'ra_deg' in data.columns:
+            return SkyCoord(data.ra_deg.values, data.dec_deg.values,
+                            frame="icrs", unit=units.deg)
+        return cls.get_sky_coords(data)
+
     def find_host_z(self, target_coords, mag=0.0, max_dist_kpc=20.):
-        sep = self.coords.separation(target_coords).to(units.arcsec).value
-        sep /= self.arcsec_per_kpc.value
-        matches = self.data[sep < max_dist_kpc]
+        candidates = self.find_candidates(target_coords, max_dist_kpc)
+        sep = self.coords[candidates].separation(target_coords).to(
+            units.arcsec).value
+        sep /= self.arcsec_per_kpc.value[candidates]
+        matches = self.get_rows(candidates[sep < max_dist_kpc])
         matches.insert(0, 'd_proj[kpc]', sep[sep < max_dist_kpc])
         if len(matches) > 0:
-            self.insert_mu_absmag_in_frame(matches, matches.z.values, mag)
+            self.insert_mu_absmag_in_frame(
+                matches, matches.z.values, mag,
+                mu=self.distmod[candidates[sep < max_dist_kpc]]
+            )
 
         matches = matches.sort_values('d_proj[kpc]')
         return matches
 
+    def find_hosts_for_frame(self, df, max_dist_kpc=20.):
+        target_coords = get_sky_coords_from_frame(df)
+        candidates = self.tree.query_ball_point(
+            self.get_unit_vectors(target_coords).reshape(-1, 3),
+            self.search_radius(max_dist_kpc)
+        )
+        target_index = np.repeat(np.arange(len(df)),
+                                 [len(c) for c in candidates])
+        galaxy_index = np.array(
+            [i for c in candidates for i in sorted(c)], dtype=int
+        )
+
+        sep = self.coords[galaxy_index].separation(
+            target_coords[target_index]).to(units.arcsec).value
+        sep /= self.arcsec_per_kpc.value[galaxy_index]
+        mask = sep < max_dist_kpc
+        order = np.lexsort((sep[mask], target_index[mask]))
+        target_index = target_index[mask][order]
+        galaxy_index = galaxy_index[mask][order]
+
+        matches = self.get_rows(galaxy_index).copy()
+        matches.insert(0, 'd_proj[kpc]', sep[mask][order])
+        if len(matches) > 0:
+            self.insert_mu_absmag_in_frame(
+                matches, matches.z.values,
+                df['Discovery Mag'].values[target_index],
+                mu=self.distmod[galaxy_index]
+            )
+        matches.index = pd.Index(df.index.values[target_index], name='Name')
+        return matches
+
+    def get_rows(self, positions):
+        if self.lazy:
+            return self.reader.fetch(positions)
+        return self.data.iloc[positions]
+
     @staticmethod
-    def insert_mu_absmag_in_frame(frame, z, mag):
-        mu = Planck15.distmod(z).value
+    def insert_mu_absmag_in_frame(frame, z, mag, mu=None):
+        if mu is None:
+            mu = distmod(z)
         abs_mag = mag - mu
         frame.insert(1, 'mu', mu)
         frame.insert(2, 'abs_mag', abs_mag)
@@ -67,7 +288,7 @@ class RedshiftCatalogue(object):
 
     # TODO: improve logic
     def generate_aladin_table(self, m):
-        coords = self.get_sky_coords(m)
+        coords = self.get_frame_sky_coords(m)
         ra = coords.ra.to_string(units.hourangle, sep=':')
         dec = [coord.split(' ')[1] for coord in coords.to_string('hmsdms')]
         dec = [
@@ -79,8 +300,7 @@ class RedshiftCatalogue(object):
         return hstack([coord_table, host_info_table])
 
     def find_host_z_from_row(self, row, max_dist_kpc=20.):
-        target_coords = SkyCoord(row.RA, row.DEC, unit=(units.hourangle,
-                                                        units.deg))
+        target_coords = get_sky_coord_from_row(row)
 
         return self.find_host_z(target_coords, mag=row['Discovery Mag'],
                                 max_dist_kpc=max_dist_kpc)
@@ -106,6 +326,7 @@ class GladeRedshiftCatalogue(RedshiftCatalogue):
 
 class TwodFRedshiftCatalogue(RedshiftCatalogue):
     short_name = '2dF'
+    coord_columns = ['ra2000', 'dec2000']
     comp_repr = ['z', 'name', 'spectra', 'ra2000',
                  'dec2000', 'BJG', 'BJSEL', 'GALEXT',
                  'SB_BJ', 'z_helio', 'quality', 'abemma',
@@ -119,6 +340,7 @@ class TwodFRedshiftCatalogue(RedshiftCatalogue):
 
 class SixdFRedshiftCatalogue(RedshiftCatalogue):
     short_name = '6dF'
+    coord_columns = ['ra', 'dec']
     comp_repr = ['z', 'TARGETNAME', 'ra', 'dec', 'mu', 'abs_mag']
 
     @staticmethod
@@ -129,7 +351,16 @@ class SixdFRedshiftCatalogue(RedshiftCatalogue):
 
 class SDSSRedshiftCatalogue(RedshiftCatalogue):
     short_name = 'sdss'
+    coord_columns = ['ra', 'dec']
 
     @staticmethod
     def get_sky_coords(data):
         return SkyCoord(data.ra, data.dec, frame="icrs", unit=units.deg)
+
+
+catalogue_classes = {
+    catalogue_class.short_name: catalogue_class for catalogue_class in [
+        GladeRedshiftCatalogue, TwodFRedshiftCatalogue,
+        SixdFRedshiftCatalogue, SDSSRedshiftCatalogue
+    ]
+}
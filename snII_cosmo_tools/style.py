@@ -1,5 +1,7 @@
 import numpy as np
+import pandas as pd
 from snII_cosmo_tools.tns_downloader import TNSDownloader
+from snII_cosmo_tools.coordinates import coord_columns
 
 survey_link_dict = {
     'ALeRCE': 'http://alerce.online/vue/object/',
@@ -10,47 +12,47 @@ survey_link_dict = {
 }
 
 
+red = 'background-color: red'
+orange = 'background-color: orange'
+green = 'background-color: green'
+
+
+def traffic_light(values, red_limit, orange_limit):
+    values = np.asarray(values, dtype=float)
+    # NaNs fail both comparisons and end up green
+    return np.select([values < red_limit, values < orange_limit],
+                     [red, orange], green).tolist()
+
+
 def highlight_dec_cut(s):
-    dec = [float(s1.split(':')[0]) for s1 in s]
-    above_cut = np.array(dec) >= 25.
-    return ['background-color: red' if v else '' for v in above_cut]
+    degrees = pd.to_numeric(pd.Series(s).astype(str).str.split(':').str[0],
+                            errors='coerce').values
+    return np.where(degrees >= 25., red, '').tolist()
 
 
 def highlight_visibility(s):
-    vis = []
-    for s1 in s:
-        if s1 < 30.:
-            vis.append('background-color: red')
-        elif s1 < 45:
-            vis.append('background-color: orange')
-        else:
-            vis.append('background-color: green')
-    return vis
+    return traffic_light(s, 30., 45.)
 
 
 def highlight_general_traffic_light(s, levels=[30., 45., 90.]):
-    prop = []
-    for s1 in s:
-        if s1 < levels[0]:
-            prop.append('background-color: red')
-        elif np.logical_and(s1 < levels[1], s1 < levels[2]):
-            prop.append('background-color: orange')
-        else:
-            prop.append('background-color: green')
-    return prop
+    return traffic_light(s, levels[0], min(levels[1], levels[2]))
 
 
 def highlight_gal_lat(s):
-    vis = []
-    for s1 in s:
-        s1 = np.abs(s1)
-        if s1 < 20.:
-            vis.append('background-color: red')
-        elif s1 < 30:
-            vis.append('background-color: orange')
-        else:
-            vis.append('background-color: green')
-    return vis
+    return traffic_light(np.abs(np.asarray(s, dtype=float)), 20., 30.)
+
+
+style_functions = {'max_alt': highlight_visibility,
+                   'gal_lat': highlight_gal_lat}
+
+
+def get_table_styles(targets):
+    columns = [column for column in style_functions
+               if column in targets.columns]
+    styles = pd.DataFrame(index=targets.index, columns=columns)
+    for column in columns:
+        styles[column] = style_functions[column](targets[column].values)
+    return styles
 
 
 def insert_tns_links_into_df(targets):
@@ -82,7 +84,17 @@ def insert_survey_links_into_df(targets):
     return targets
 
 
-def get_styled_html_table(targets):
-    return targets.style.apply(
-        highlight_visibility, subset=['max_alt']).apply(
-            highlight_gal_lat, subset=['gal_lat']).hide_index().render()
+def get_styled_html_table(targets, styles=None):
+    if styles is None:
+        styles = get_table_styles(targets)
+    styler = targets.style
+    if len(styles.columns) > 0:
+        styler = styler.apply(
+            lambda data: pd.DataFrame(styles.values, index=data.index,
+                                      columns=data.columns),
+            axis=None, subset=list(styles.columns))
+    styler = styler.hide_index()
+    hidden_columns = [c for c in coord_columns if c in targets.columns]
+    if hidden_columns:
+        styler = styler.hide_columns(hidden_columns)
+    return styler.render()
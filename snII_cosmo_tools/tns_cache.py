@@ -0,0 +1,134 @@
+import os
+import warnings
+import pandas as pd
+from datetime import datetime, timedelta
+from .tns_downloader import TNSDownloader
+from .http_client import client
+
+
+class TNSCache(object):
+    date_column = 'Discovery Date (UT)'
+    time_format = '%Y-%m-%d %H:%M:%S'
+
+    def __init__(self, path='data/tns_cache.hdf', refresh_days=30.,
+                 max_age_hours=1.):
+        self.path = path
+        self.refresh_days = refresh_days
+        self.max_age_hours = max_age_hours
+        self._objects = None
+        self._state = None
+
+    @property
+    def objects(self):
+        if self._objects is None:
+            self.load()
+        return self._objects
+
+    @property
+    def state(self):
+        if self._state is None:
+            self.load()
+        return self._state
+
+    def load(self):
+        self._objects = pd.DataFrame()
+        self._state = pd.Series(dtype=object)
+        if os.path.isfile(self.path):
+            with pd.HDFStore(self.path, mode='r') as hdf:
+                if '/objects' in hdf.keys():
+                    self._objects = hdf['objects']
+                if '/state' in hdf.keys():
+                    self._state = hdf['state']
+
+    def save(self):
+        with pd.HDFStore(self.path) as hdf:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                hdf.put('objects', self._objects)
+                hdf.put('state', self._state)
+
+    def merge(self, new_objects):
+        if len(new_objects) == 0:
+            return
+        # rows downloaded last win, which picks up reclassifications
+        objects = pd.concat([self.objects, new_objects], ignore_index=True,
+                            sort=False)
+        objects = objects.drop_duplicates('Name', keep='last')
+        self._objects = objects.sort_values(
+            self.date_column, ascending=False).reset_index(drop=True)
+
+    @staticmethod
+    def download(start_date, end_date):
+        return TNSDownloader(date_range=(start_date, end_date)).download()
+
+    @property
+    def last_sync(self):
+        last_sync = self.state.get('last_sync')
+        if last_sync is not None:
+            return datetime.strptime(last_sync, self.time_format)
+
+    def needs_sync(self, start_date):
+        synced_start = self.state.get('synced_start')
+        if synced_start is None or self.last_sync is None:
+            return True
+        age = client.now() - self.last_sync
+        return (start_date < synced_start or
+                age > timedelta(hours=self.max_age_hours))
+
+    def sync(self, start_date):
+        now = client.now()
+        synced_start = self.state.get('synced_start')
+        if synced_start is None or self.last_sync is None:
+            self.merge(self.download(start_date, "2100-01-01"))
+            synced_start = start_date
+        else:
+            if start_date < synced_start:
+                self.merge(self.download(start_date, synced_start))
+                synced_start = start_date
+            # objects discovered since the last sync plus a window of
+            # recent ones whose classification may have changed
+            refresh_start = datetime.strftime(
+                self.last_sync - timedelta(self.refresh_days), '%Y-%m-%d'
+            )
+            self.merge(self.download(max(refresh_start, synced_start),
+                                     "2100-01-01"))
+        self._state = pd.Series({
+            'synced_start': synced_start,
+            'last_sync': datetime.strftime(now, self.time_format)
+        })
+        self.save()
+
+    def select(self, downloader):
+        objects = self.objects
+        if len(objects) == 0:
+            return objects
+        dates = objects[self.date_column].astype(str).str[:10]
+        mask = ((dates >= downloader.start_date) &
+                (dates <= downloader.end_date))
+        obj_type = objects['Obj. Type']
+        if downloader.obj_type:
+            mask &= obj_type == downloader.obj_type
+        if downloader.query_dict.get('classified_sne'):
+            mask &= obj_type.astype(str).str.startswith('SN')
+        return objects[mask].reset_index(drop=True)
+
+    def query(self, downloader):
+        if self.needs_sync(downloader.start_date):
+            self.sync(downloader.start_date)
+        return self.select(downloader)
+
+    @staticmethod
+    def strip_prefix(name):
+        return name.split(' ')[-1]
+
+    def query_object(self, downloader):
+        name = self.strip_prefix(downloader.name)
+        if len(self.objects) > 0:
+            names = self.objects.Name.str.split(' ').str[-1]
+            match = self.objects[names == name]
+            if len(match) > 0:
+                return match.reset_index(drop=True)
+        result = downloader.download()
+        self.merge(result)
+        self.save()
+        return result
@@ -1,5 +1,8 @@
 import io
+import os
 import json
+import time
+import hashlib
 import requests
 import webbrowser
 import numpy as np
@@ -11,6 +14,8 @@ from bokeh.palettes import colorblind
 from bokeh.models import Arrow, Label, HoverTool
 from bokeh.models.sources import ColumnDataSource
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from .http_client import client
 
 # http://astronotes.co.uk/blog/2016/01/28/Parsing-The-Transient-Name-Server.html
 query_dict = {"num_page": "500",
@@ -32,14 +37,24 @@ class TNSDownloader(object):
                     'Discovery Date (UT)']
 
     obj_type_keys = {'SN II': 10, 'SN Ia': 3, 'SN IIP': 11}
+    max_concurrent_pages = 4
+    max_pages = 100
+    cache = None  # set to a TNSCache to serve queries from a local store
 
     def __init__(self, number_of_days=1., obj_type=None,
-                 only_classified_sne=False, date_range=None):
-        self._search = None
+                 only_classified_sne=False, date_range=None,
+                 max_concurrent_pages=None, max_pages=None,
+                 reference_date=None):
+        if max_concurrent_pages:
+            self.max_concurrent_pages = max_concurrent_pages
+        if max_pages:
+            self.max_pages = max_pages
         self.obj_type = obj_type
         if not date_range:
+            if reference_date is None:
+                reference_date = client.now()
             self.start_date = datetime.strftime(
-                datetime.now() - timedelta(number_of_days), '%Y-%m-%d')
+                reference_date - timedelta(number_of_days), '%Y-%m-%d')
             self.end_date = "2100-01-01"
         else:
             self.start_date = date_range[0]
@@ -57,25 +72,62 @@ class TNSDownloader(object):
         if only_classified_sne:
             self.query_dict["classified_sne"] = "1"
 
+    def get_page(self, page):
+        params = dict(self.query_dict, page=page, format='csv')
+        csv_query = client.get(self.url, params=params)
+        if csv_query.status_code != 200:
+            raise TNSDownloadError(
+                'Page {} of the search failed with status {}.'.format(
+                    page, csv_query.status_code)
+            )
+        content = csv_query.content.decode("utf-8")
+        if not content.strip():
+            return pd.DataFrame()
+        return pd.read_csv(io.StringIO(content))
+
     def query(self):
+        if self.cache is not None:
+            self._result = self.cache.query(self)
+        else:
+            self._result = self.download()
+
+    def download(self):
         print("Making a query!")
-        self._search = requests.get(url=self.url, params=self.query_dict)
-        csv_query = requests.get(self._search.url + "&format=csv")
-        buff = io.StringIO(csv_query.content.decode("utf-8"))
-        self._result = pd.read_csv(buff)
-        if len(self._result) == self.max_target_num:
-            msg = "Number of targets exceeds maximum of {}.".format(
-                self.max_target_num
-            )
-            msg += "\nAdditional targets would get discarded."
-            raise TNSDownloadError(msg)
+        # most queries fit on one page, only fan out if it comes back full
+        pages = [self.get_page(0)]
+        with ThreadPoolExecutor(self.max_concurrent_pages) as executor:
+            while len(pages[-1]) >= self.max_target_num:
+                batch = range(len(pages), min(
+                    len(pages) + self.max_concurrent_pages, self.max_pages))
+                if len(batch) == 0:
+                    msg = "Number of targets exceeds maximum of {}.".format(
+                        self.max_pages * self.max_target_num
+                    )
+                    msg += "\nAdditional targets would get discarded."
+                    raise TNSDownloadError(msg)
+                pages.extend(executor.map(self.get_page, batch))
+                last_page = [
+                    i for i, page in enumerate(pages)
+                    if len(page) < self.max_target_num
+                ]
+                if last_page:
+                    pages = pages[:last_page[0] + 1]
+        result = pd.concat(pages, ignore_index=True, sort=False)
+        if 'Name' in result.columns:
+            result = result.drop_duplicates('Name').reset_index(drop=True)
+        return result
 
     @property
     def max_target_num(self):
         return int(self.query_dict['num_page'])
 
+    @property
+    def search_url(self):
+        return requests.Request('GET', self.url,
+                                params=self.query_dict).prepare().url
+
     def open_in_browser(self):
-        webbrowser.open(self._search.url)
+        webbrowser.open(self.search_url)
 
     def open_object_in_browser(self, name):
         webbrowser.open(self.get_object_link(name))
@@ -102,7 +154,12 @@ class TNSObjectDownloader(TNSDownloader):
         self.name = name
         self.query_dict = query_dict.copy()
         self.query_dict['name'] = name
-        self._search = None
+
+    def query(self):
+        if self.cache is not None:
+            self._result = self.cache.query_object(self)
+        else:
+            self._result = self.download()
 
     @property
     def series(self):
@@ -115,8 +172,12 @@ class TNSObjectDownloader(TNSDownloader):
 class TNSSpectrum(object):
     base_url = 'https://wis-tns.weizmann.ac.il/object/'
 
-    def __init__(self, name):
+    def __init__(self, name, cache_dir='data/spectra', max_workers=4,
+                 ttl_hours=24.):
         self.name = name.strip('AT').strip('SN').strip(' ')
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+        self.ttl_hours = ttl_hours
         self._spec = None
         self._spec_url = None
 
@@ -127,44 +188,147 @@ class TNSSpectrum(object):
     @property
     def spec_url(self):
         if not self._spec_url:
-            print('Retrieving spec urls')
-            html = requests.get(self.url)
-            bs = BeautifulSoup(html.text, 'html.parser')
-            ascii_cell = bs.find_all('td', class_="cell-asciifile")
-            urls = [elem.find('a')['href'] for elem in ascii_cell]
-            groups = [
-                group.text for group in bs.find_all(
-                    id='spectra-fieldset')[0].find_all(
-                        'td', class_='cell-groups')
-            ]
-
-            if len(urls) == 0:
-                raise TNSDownloadError('Found no possible urls')
-            self._spec_url = dict(zip(groups, urls))
+            if self.url_cache_is_fresh:
+                with open(self.url_cache_fname) as f:
+                    cached = json.load(f)
+                self._spec_url = dict(zip(cached['groups'], cached['urls']))
+            else:
+                self._spec_url = self.download_spec_url()
+                self.save_spec_url()
         return self._spec_url
 
+    def download_spec_url(self):
+        print('Retrieving spec urls')
+        html = client.get(self.url)
+        bs = BeautifulSoup(html.text, 'html.parser')
+        ascii_cell = bs.find_all('td', class_="cell-asciifile")
+        urls = [elem.find('a')['href'] for elem in ascii_cell]
+        groups = [
+            group.text for group in bs.find_all(
+                id='spectra-fieldset')[0].find_all(
+                    'td', class_='cell-groups')
+        ]
+
+        if len(urls) == 0:
+            raise TNSDownloadError('Found no possible urls')
+        return dict(zip(groups, urls))
+
+    @staticmethod
+    def parse_spectrum(url, text):
+        with io.StringIO(text) as spec_buff:
+            if 'ePESSTO' in url:
+                names = ['wave', 'flux']
+                sep = '\t'
+            elif 'Asiago' in url:
+                names = ['wave', 'flux']
+                sep = '  '
+            else:
+                names = ['wave', 'flux', 'idk']
+                sep = ' '
+            return pd.read_csv(spec_buff, comment='#', names=names,
+                               header=None, sep=sep)
+
+    @classmethod
+    def download_spectrum(cls, url):
+        print('Downloading spectrum')
+        response = client.get(url)
+        if response.status_code != 200:
+            raise TNSDownloadError(
+                'Download of {} failed with status {}.'.format(
+                    url, response.status_code)
+            )
+        return cls.parse_spectrum(url, response.text)
+
+    @property
+    def url_cache_fname(self):
+        return os.path.join(self.cache_dir,
+                            self.name.replace(' ', '') + '.json')
+
+    @property
+    def url_cache_is_fresh(self):
+        # new spectra may be uploaded, so the list of urls expires
+        if not os.path.isfile(self.url_cache_fname):
+            return False
+        age = time.time() - os.path.getmtime(self.url_cache_fname)
+        return age < self.ttl_hours * 3600.
+
+    def save_spec_url(self):
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        with open(self.url_cache_fname, 'w') as f:
+            json.dump({'groups': list(self._spec_url.keys()),
+                       'urls': list(self._spec_url.values())}, f)
+
+    def spectrum_cache_fname(self, url):
+        url_hash = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, url_hash + '.npz')
+
+    def get_spectrum(self, url):
+        # a spectrum behind a url does not change, so it is cached for good
+        cache_fname = self.spectrum_cache_fname(url)
+        if os.path.isfile(cache_fname):
+            with np.load(cache_fname) as cached:
+                columns = [str(column) for column in cached['columns']]
+                return pd.DataFrame({
+                    column: cached['column_{}'.format(i)]
+                    for i, column in enumerate(columns)
+                }, columns=columns)
+        spectrum = self.download_spectrum(url)
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        arrays = {'column_{}'.format(i): spectrum[column].values
+                  for i, column in enumerate(spectrum.columns)}
+        np.savez_compressed(cache_fname,
+                            columns=np.array(spectrum.columns, dtype=str),
+                            **arrays)
+        return spectrum
+
     @property
     def spec(self):
         if self._spec is None:
-            self._spec = {}
-            for group, url in self.spec_url.items():
-                print('Downloading spectrum')
-                spec_raw = requests.get(url)
-                with io.StringIO(spec_raw.text) as spec_buff:
-                    if 'ePESSTO' in url:
-                        names = ['wave', 'flux']
-                        sep = '\t'
-                    elif 'Asiago' in url:
-                        names = ['wave', 'flux']
-                        sep = '  '
-                    else:
-                        names = ['wave', 'flux', 'idk']
-                        sep = ' '
-                    self._spec[group] = pd.read_csv(spec_buff, comment='#',
-                                                    names=names,
-                                                    header=None, sep=sep)
+            with ThreadPoolExecutor(self.max_workers) as executor:
+                self._spec = dict(zip(
+                    self.spec_url.keys(),
+                    executor.map(self.get_spectrum, self.spec_url.values())
+                ))
         return self._spec
 
+    @classmethod
+    def fetch_many(cls, names, max_workers=8, **kwargs):
+        spectra = [cls(name, **kwargs) for name in names]
+        failures = {}
+
+        def get_spec_url(spectrum):
+            try:
+                return spectrum.spec_url
+            except TNSDownloadError:
+                return {}
+            except Exception as e:
+                failures[spectrum.name] = e
+                return {}
+
+        with ThreadPoolExecutor(max_workers) as executor:
+            spec_urls = list(executor.map(get_spec_url, spectra))
+            futures = [
+                [executor.submit(spectrum.get_spectrum, url)
+                 for url in spec_url.values()]
+                for spectrum, spec_url in zip(spectra, spec_urls)
+            ]
+            for spectrum, spec_url, spectrum_futures in zip(
+                    spectra, spec_urls, futures):
+                if not spectrum_futures:
+                    continue
+                try:
+                    spectrum._spec = dict(zip(
+                        spec_url.keys(),
+                        [future.result() for future in spectrum_futures]
+                    ))
+                except Exception as e:
+                    failures[spectrum.name] = e
+        for name, error in failures.items():
+            print('Failed downloading spectra of {}: {}'.format(name, error))
+        return dict(zip(names, spectra))
+
     def plot(self):
         f = figure(x_axis_label='Wavelength [\u00C5]', y_axis_label='Flux',
                    width=400, height=170)
@@ -179,6 +343,84 @@ class TNSSpectrum(object):
         return f
 
 
+class ZtfLightCurve(object):
+    bands = ['g', 'r']
+    band_ids = {'g': 1, 'r': 2}
+    columns = ['candid', 'fid', 'mjd', 'magpsf']
+    non_detection_margin = 0.4
+
+    def __init__(self, candidates, name=None):
+        self.name = name
+        detections, non_detections = [], []
+        for candidate in candidates:
+            if 'candid' in candidate:
+                detections.append(candidate)
+            else:
+                non_detections.append(candidate)
+        # separate frames keep the integer candids of the detections exact
+        self.detections = self.split_bands(detections)
+        self.non_detections = self.split_bands(non_detections)
+
+        self.first_detection = self.find_first_detection()
+        self.best_non_detection = self.find_best_non_detection()
+        self.delta_non_detection = None
+        if self.best_non_detection is not None:
+            self.delta_non_detection = (self.first_detection.mjd -
+                                        self.best_non_detection.mjd)
+
+    def split_bands(self, candidates):
+        frame = pd.DataFrame(candidates)
+        for column in self.columns:
+            if column not in frame.columns:
+                frame[column] = np.nan
+        fid = frame.fid.values
+        return {band: frame[fid == self.band_ids[band]]
+                for band in self.bands}
+
+    @classmethod
+    def from_json(cls, payload, name=None):
+        return cls(payload['candidates'], name=name)
+
+    def find_first_detection(self):
+        detections = pd.concat([self.detections[band] for band in self.bands])
+        if len(detections) == 0:
+            return None
+        return detections.iloc[np.argmin(detections.mjd.values)]
+
+    def find_best_non_detection(self):
+        if self.first_detection is None:
+            return None
+        non_detections = pd.concat(
+            [self.non_detections[band] for band in self.bands]
+        )
+        deep_mask = non_detections.magpsf.values > (
+            self.first_detection.magpsf + self.non_detection_margin)
+        earlier_mask = non_detections.mjd.values < self.first_detection.mjd
+        non_detections = non_detections[np.logical_and(deep_mask,
+                                                       earlier_mask)]
+        if len(non_detections) == 0:
+            return None
+        return non_detections.iloc[np.argmax(non_detections.mjd.values)]
+
+    @classmethod
+    def summary(cls, light_curves):
+        rows = []
+        for light_curve in light_curves:
+            first = light_curve.first_detection
+            best_non = light_curve.best_non_detection
+            rows.append({
+                'first_detection_mjd': np.nan if first is None else first.mjd,
+                'first_detection_mag': (np.nan if first is None
+                                        else first.magpsf),
+                'best_non_detection_mjd': (np.nan if best_non is None
+                                           else best_non.mjd),
+                'delta_non_detection': (np.nan if best_non is None
+                                        else light_curve.delta_non_detection)
+            })
+        return pd.DataFrame(rows, index=[light_curve.name
+                                         for light_curve in light_curves])
+
+
 class ZtfLightCurveDownloader(object):
     base_url = 'https://lasair.roe.ac.uk/object/'
     bands = ['g', 'r']
@@ -186,49 +428,91 @@ class ZtfLightCurveDownloader(object):
         'https://lasair.roe.ac.uk/lasair/static/ztf/stamps/jpg/{{id[:3]}}/candid{{id}}.jpg'
     )
 
-    def __init__(self, name):
+    def __init__(self, name, cache_dir='data/ztf_lightcurves',
+                 ttl_hours=12.):
         self.name = name
+        self.cache_dir = cache_dir
+        self.ttl_hours = ttl_hours
         self._json = None
-        self._non_detections = None
-        self._detections = None
+        self._light_curve = None
 
     @property
     def url(self):
         return self.base_url + self.name.replace(' ', '') + '/json'
 
+    @property
+    def cache_fname(self):
+        return os.path.join(self.cache_dir,
+                            self.name.replace(' ', '') + '.json')
+
+    @property
+    def cache_is_fresh(self):
+        if not os.path.isfile(self.cache_fname):
+            return False
+        age = time.time() - os.path.getmtime(self.cache_fname)
+        return age < self.ttl_hours * 3600.
+
+    def download(self):
+        response = client.get(self.url)
+        if response.status_code != 200:
+            raise TNSDownloadError(
+                'Light curve download of {} failed with status {}.'.format(
+                    self.name, response.status_code)
+            )
+        text = response.text
+        try:
+            payload = json.loads(text)
+        except ValueError:
+            raise TNSDownloadError(
+                'Light curve of {} is not valid JSON.'.format(self.name))
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        with open(self.cache_fname, 'w') as f:
+            f.write(text)
+        return payload
+
     @property
     def json(self):
-        if not self._json:
-            self._json = json.loads(requests.get(self.url).text)
+        if self._json is None:
+            if self.cache_is_fresh:
+                with open(self.cache_fname) as f:
+                    self._json = json.load(f)
+            else:
+                self._json = self.download()
         return self._json
 
+    @classmethod
+    def download_many(cls, names, max_workers=8, **kwargs):
+        downloaders = [cls(name, **kwargs) for name in names]
+        failures = {}
+
+        def get_json(downloader):
+            try:
+                downloader.json
+            except Exception as e:
+                failures[downloader.name] = e
+
+        with ThreadPoolExecutor(max_workers) as executor:
+            list(executor.map(get_json, downloaders))
+        for name, error in failures.items():
+            print('Failed downloading light curve of {}: {}'.format(
+                name, error))
+        return dict(zip(names, downloaders))
+
+    @property
+    def light_curve(self):
+        if self._light_curve is None:
+            self._light_curve = ZtfLightCurve.from_json(self.json,
+                                                        name=self.name)
+        return self._light_curve
+
     @property
     def non_detections(self):
-        if not self._non_detections:
-            non_detections = []
-            for candidate in self.json['candidates']:
-                if 'candid' not in candidate:
-                    non_detections.append(candidate)
-            non_detections = pd.DataFrame(non_detections)
-            self._non_detections = {
-                'g': non_detections[non_detections.fid == 1],
-                'r': non_detections[non_detections.fid == 2]
-            }
-        return self._non_detections
+        return self.light_curve.non_detections
 
     @property
     def detections(self):
-        if not self._detections:
-            detections = []
-            for candidate in self.json['candidates']:
-                if 'candid' in candidate:
-                    detections.append(candidate)
-            detections = pd.DataFrame(detections)
-            self._detections = {
-                'g': detections[detections.fid == 1],
-                'r': detections[detections.fid == 2]
-            }
-        return self._detections
+        return self.light_curve.detections
 
     def plot(self):
         hover = HoverTool(
@@ -278,27 +562,11 @@ class ZtfLightCurveDownloader(object):
 
     @property
     def first_detection(self):
-        return pd.concat(
-            [self.detections[band] for band in self.bands]).sort_values(
-                'mjd', ascending=True).iloc[0]
+        return self.light_curve.first_detection
 
     @property
     def best_non_detection(self):
-        non_detections = pd.concat(
-            [self.non_detections[band] for band in self.bands]
-        )
-        deep_mask = non_detections.magpsf > (self.first_detection.magpsf + 0.4)
-        earlier_mask = non_detections.mjd < self.first_detection.mjd
-        non_detections = non_detections[np.logical_and(deep_mask,
-                                                       earlier_mask)]
-        if len(non_detections) > 0:
-            i = np.argmin(
-                (self.first_detection.mjd - non_detections.mjd).values
-            )
-            best_non_detection = non_detections.iloc[i]
-        else:
-            best_non_detection = None
-        return best_non_detection
+        return self.light_curve.best_non_detection
 
     @property
     def cutout_urls(self):
@@ -312,4 +580,4 @@ class ZtfLightCurveDownloader(object):
 
     @property
     def delta_non_detection(self):
-        return self.first_detection.mjd - self.best_non_detection.mjd
+        return self.light_curve.delta_non_detection
@@ -1,50 +1,180 @@
 import io
 import imageio
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import astropy.units as u
 from astropy.time import Time, TimeDelta
 from datetime import datetime, timedelta
 from ipywidgets import IntSlider, interactive
 from matplotlib.dates import DateFormatter
 from mpl_toolkits.axes_grid1.inset_locator import inset_axes
-from astropy.coordinates import (SkyCoord, EarthLocation,
+from astropy.coordinates import (EarthLocation, FK5, Latitude,
                                  AltAz, get_sun, get_moon)
+from .coordinates import get_sky_coords_from_frame
+
+
+def get_fast_alt(skycoord_of_date, local_sidereal_time, location):
+    # hour angle from the sidereal time grid, no refraction (like the
+    # default AltAz frame); good to ~0.1 deg
+    lat = location.lat
+    dec = skycoord_of_date.dec
+    hour_angle = local_sidereal_time - skycoord_of_date.ra
+    sin_alt = (np.sin(dec) * np.sin(lat) +
+               np.cos(dec) * np.cos(lat) * np.cos(hour_angle))
+    return Latitude(np.degrees(np.arcsin(np.clip(sin_alt.value, -1., 1.))),
+                    unit=u.deg)
+
+
+class Ephemeris(object):
+    def __init__(self, location, midnight, delta_midnight):
+        self.location = location
+        self.midnight = midnight
+        self.delta_midnight = delta_midnight
+        self.time = midnight + delta_midnight
+        self.frame = AltAz(obstime=self.time, location=location)
+        self._sun_alt = None
+        self._moon_alt = None
+        self._moon_midnight = None
+        self._moon_illumination = None
+        self._local_sidereal_time = None
+
+    @property
+    def local_sidereal_time(self):
+        if self._local_sidereal_time is None:
+            self._local_sidereal_time = self.time.sidereal_time(
+                'mean', longitude=self.location.lon
+            )
+        return self._local_sidereal_time
+
+    @property
+    def sun_alt(self):
+        if self._sun_alt is None:
+            self._sun_alt = get_sun(self.time).transform_to(self.frame).alt
+        return self._sun_alt
+
+    @property
+    def moon_alt(self):
+        if self._moon_alt is None:
+            self._moon_alt = get_moon(self.time).transform_to(self.frame).alt
+        return self._moon_alt
+
+    @property
+    def moon_midnight(self):
+        if self._moon_midnight is None:
+            self._moon_midnight = get_moon(self.midnight)
+        return self._moon_midnight
+
+    @property
+    def moon_illumination(self):
+        if self._moon_illumination is None:
+            self._moon_illumination = Visibility.get_moon_illumination(
+                self.midnight
+            )
+        return self._moon_illumination
+
+
+class EphemerisCache(object):
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._ephemerides = OrderedDict()
+
+    @staticmethod
+    def get_key(location, midnight, delta_midnight):
+        return (tuple(c.to_value(u.m) for c in location.geocentric),
+                midnight.jd1, midnight.jd2,
+                delta_midnight.to_value(u.hour).tobytes())
+
+    def get(self, location, midnight, delta_midnight):
+        key = self.get_key(location, midnight, delta_midnight)
+        if key in self._ephemerides:
+            self._ephemerides.move_to_end(key)
+        else:
+            self._ephemerides[key] = Ephemeris(location, midnight,
+                                               delta_midnight)
+            if len(self._ephemerides) > self.maxsize:
+                self._ephemerides.popitem(last=False)
+        return self._ephemerides[key]
+
+    def clear(self):
+        self._ephemerides.clear()
+
+
+ephemeris_cache = EphemerisCache()
 
 
 class Visibility(object):
+    backends = ['astropy', 'fast']
+
     def __init__(self, skycoord, utcoffset=(-4 * u.hour),
-                 location=None, date_offset=0):
+                 location=None, date_offset=0, backend='astropy'):
+        if backend not in self.backends:
+            raise ValueError(
+                '{} is not a valid backend. Select one of {}'.format(
+                    backend, self.backends)
+            )
+        self.backend = backend
         self.date = datetime.strftime(
             datetime.now() + timedelta(days=date_offset),
             '%Y-%m-%d'
         )
         self._date_offset = date_offset
-        if not location:
+        if location is None:
             location = EarthLocation.of_site('paranal')
         self.location = location
         self.utcoffset = utcoffset
         self.midnight = Time(self.date + ' 23:59:59') - utcoffset
         self.skycoord = skycoord
         self.delta_midnight = np.linspace(-12, 12, 100) * u.hour
-        self.frame = AltAz(obstime=self.midnight + self.delta_midnight,
-                           location=self.location)
+        self._ephemeris = None
+        self._skycoord_of_date = None
+        self.frame = self.ephemeris.frame
+
+    @property
+    def ephemeris(self):
+        if self._ephemeris is None:
+            self._ephemeris = ephemeris_cache.get(
+                self.location, self.midnight, self.delta_midnight
+            )
+        return self._ephemeris
 
     @property
     def alt(self):
+        if self.backend == 'fast':
+            return self.fast_alt
         return self.skycoord.transform_to(self.frame).alt
 
+    @property
+    def skycoord_of_date(self):
+        # precession over a few weeks is far below the fast backend's
+        # accuracy, so the coordinates are precessed only once
+        if self._skycoord_of_date is None:
+            self._skycoord_of_date = self.skycoord.transform_to(
+                FK5(equinox=self.midnight)
+            )
+        return self._skycoord_of_date
+
+    @property
+    def fast_alt(self):
+        return get_fast_alt(self.skycoord_of_date,
+                            self.ephemeris.local_sidereal_time,
+                            self.location)
+
     @property
     def sun_alt(self):
-        return get_sun(self.time).transform_to(self.frame).alt
+        return self.ephemeris.sun_alt
 
     @property
     def moon_alt(self):
-        return get_moon(self.time).transform_to(self.frame).alt
+        return self.ephemeris.moon_alt
 
     @property
     def moon_distance_midnight(self):
-        moon_coord = get_moon(self.midnight)
+        moon_coord = self.ephemeris.moon_midnight
         return moon_coord.separation(self.skycoord).to(u.deg).value
 
     @property
@@ -57,7 +187,7 @@ class Visibility(object):
 
     @property
     def max_alt(self):
-        return self.alt[self.night_mask].max()
+        return self.alt[..., self.night_mask].max(axis=-1)
 
     @property
     def start_night(self):
@@ -77,9 +207,10 @@ class Visibility(object):
 
     @property
     def moon_illumination(self):
-        return self.get_moon_illumination(self.midnight)
+        return self.ephemeris.moon_illumination
 
-    def get_moon_illumination(self, time):
+    @staticmethod
+    def get_moon_illumination(time):
         sun = get_sun(time)
         moon = get_moon(time)
         sep = sun.separation(moon)
@@ -106,7 +237,7 @@ class Visibility(object):
         self.date_text = self.ax.text(-11.5, 5, date, color='white',
                                       bbox=dict(facecolor='black'))
         self.ax.set_xlim(-12, 12)
-        plt.xticks(np.arange(13) * 2 - 12)
+        self.ax.set_xticks(np.arange(13) * 2 - 12)
         self.ax.set_ylim(0, 90)
         self.plot_twilight()
         self.ax.set_xlabel('Hours from Midnight')
@@ -114,14 +245,16 @@ class Visibility(object):
         return self.fig
 
     def plot_twilight(self):
-        self.ax.fill_between([self.sun_rise.value, 12], 0, 90,
-                             color='0.5', zorder=0)
-        self.ax.fill_between([-12, self.sun_set.value], 0, 90,
-                             color='0.5', zorder=0)
-        self.ax.fill_between([self.end_night.value, self.sun_rise.value],
-                             0, 90, color='0.5', zorder=0, alpha=0.3)
-        self.ax.fill_between([self.sun_set.value, self.start_night.value],
-                             0, 90, color='0.5', zorder=0, alpha=0.3)
+        self.twilight = [
+            self.ax.fill_between([self.sun_rise.value, 12], 0, 90,
+                                 color='0.5', zorder=0),
+            self.ax.fill_between([-12, self.sun_set.value], 0, 90,
+                                 color='0.5', zorder=0),
+            self.ax.fill_between([self.end_night.value, self.sun_rise.value],
+                                 0, 90, color='0.5', zorder=0, alpha=0.3),
+            self.ax.fill_between([self.sun_set.value, self.start_night.value],
+                                 0, 90, color='0.5', zorder=0, alpha=0.3)
+        ]
 
     @property
     def date_offset(self):
@@ -135,16 +268,17 @@ class Visibility(object):
             '%Y-%m-%d'
         )
         self.midnight = Time(self.date + ' 23:59:59') - self.utcoffset
-        self.frame = AltAz(obstime=self.midnight + self.delta_midnight,
-                           location=self.location)
+        self._ephemeris = None
+        self.frame = self.ephemeris.frame
 
     def update_plot(self, date_offset):
         self.date_offset = date_offset
         self.line_obj.set_ydata(self.alt)
         self.line_moon.set_ydata(self.moon_alt)
-        if date_offset % 15 == 0:
-            self.ax.collections.clear()
-            self.plot_twilight()
+        # redrawn every time, so a frame only depends on its own offset
+        for artist in self.twilight:
+            artist.remove()
+        self.plot_twilight()
         self.moon_distance.set_text(
             "Moon distance: {:.1f}".format(self.moon_distance_midnight)
         )
@@ -155,18 +289,34 @@ class Visibility(object):
                                                          self.date_offset))
         self.fig.canvas.draw_idle()
 
-    def create_gif(self, offsets, duration=0.5, dpi=200):
-        images = []
-        self.plot()
-        for i in offsets:
-            buf = io.BytesIO()
-            self.update_plot(i)
-            self.fig.savefig(buf, dpi=dpi)
-            buf.seek(0)
-            images.append(imageio.imread(buf))
-        out = imageio.mimwrite('<bytes>', images,
-                               duration=duration, format='gif')
-        return io.BytesIO(out)
+    @property
+    def init_kwargs(self):
+        return {'skycoord': self.skycoord, 'utcoffset': self.utcoffset,
+                'location': self.location, 'backend': self.backend}
+
+    def create_gif(self, offsets, duration=0.5, dpi=200, processes=None,
+                   uri=None):
+        offsets = list(offsets)
+        out = uri if uri else io.BytesIO()
+        # the gif writer keeps all frames in memory until it is closed
+        writer = imageio.get_writer(out, format='gif', mode='I',
+                                    duration=duration)
+        with writer:
+            if processes:
+                chunksize = max(1, len(offsets) // processes)
+                with ProcessPoolExecutor(
+                        processes, initializer=_init_gif_worker,
+                        initargs=(self.init_kwargs, dpi)) as executor:
+                    for image in executor.map(_render_gif_frame, offsets,
+                                              chunksize=chunksize):
+                        writer.append_data(image)
+            else:
+                renderer = GifFrameRenderer(self.init_kwargs, dpi)
+                for offset in offsets:
+                    writer.append_data(renderer(offset))
+        if not uri:
+            out.seek(0)
+            return out
 
     def time_series(self, number_of_days=14.):
         dt_value = 15 * u.min
@@ -226,25 +376,159 @@ class InteractiveVisibility(Visibility):
                                        date_offset=self.date_offset_widget)
 
 
-def get_max_alt_from_frame(df):
-    max_alt = []
-    for index, row in df.iterrows():
-        coord = SkyCoord(row.RA, row.DEC, unit=(u.hourangle, u.deg))
-        vis = Visibility(skycoord=coord)
-        max_alt.append(vis.max_alt.value)
-    return np.array(max_alt)
+class VisibilityPlanner(object):
+    def __init__(self, skycoord, number_of_nights=14, utcoffset=(-4 * u.hour),
+                 location=None, date_offset=0, airmass_limit=2.,
+                 backend='fast', num_samples=100):
+        if backend not in Visibility.backends:
+            raise ValueError(
+                '{} is not a valid backend. Select one of {}'.format(
+                    backend, Visibility.backends)
+            )
+        if location is None:
+            location = EarthLocation.of_site('paranal')
+        self.skycoord = skycoord
+        self.location = location
+        self.utcoffset = utcoffset
+        self.airmass_limit = airmass_limit
+        self.backend = backend
+        self.names = None
+        self.dates = [
+            datetime.strftime(
+                datetime.now() + timedelta(days=date_offset + i), '%Y-%m-%d'
+            ) for i in range(number_of_nights)
+        ]
+        self.midnight = Time([date + ' 23:59:59'
+                              for date in self.dates]) - utcoffset
+        self.delta_midnight = np.linspace(-12, 12, num_samples) * u.hour
+        self.time = self.midnight[:, np.newaxis] + self.delta_midnight
+        self.frame = AltAz(obstime=self.time, location=self.location)
+        self._alt = None
+        self._sun_alt = None
+        self._moon_midnight = None
+
+    @classmethod
+    def from_frame(cls, df, **kwargs):
+        planner = cls(get_sky_coords_from_frame(df), **kwargs)
+        planner.names = df.index
+        return planner
+
+    @property
+    def alt(self):
+        # targets x nights x time samples
+        if self._alt is None:
+            skycoord = self.skycoord.reshape(self.skycoord.shape + (1, 1))
+            if self.backend == 'fast':
+                skycoord_of_date = skycoord.transform_to(
+                    FK5(equinox=self.midnight[0])
+                )
+                local_sidereal_time = self.time.sidereal_time(
+                    'mean', longitude=self.location.lon
+                )
+                self._alt = get_fast_alt(skycoord_of_date,
+                                         local_sidereal_time, self.location)
+            else:
+                self._alt = skycoord.transform_to(self.frame).alt
+        return self._alt
+
+    @property
+    def sun_alt(self):
+        if self._sun_alt is None:
+            self._sun_alt = get_sun(self.time).transform_to(self.frame).alt
+        return self._sun_alt
+
+    @property
+    def night_mask(self):
+        return self.sun_alt < -18. * u.deg
+
+    @property
+    def min_alt(self):
+        return np.degrees(np.arcsin(1. / self.airmass_limit)) * u.deg
+
+    @property
+    def observable_mask(self):
+        return np.logical_and(self.alt > self.min_alt, self.night_mask)
+
+    @property
+    def observable_hours(self):
+        dt = (self.delta_midnight[1] - self.delta_midnight[0]).to(u.hour)
+        return self.observable_mask.sum(axis=-1) * dt.value
+
+    @property
+    def max_alt(self):
+        night_alt = np.where(self.night_mask, self.alt.to_value(u.deg), -90.)
+        return night_alt.max(axis=-1)
+
+    @property
+    def moon_midnight(self):
+        if self._moon_midnight is None:
+            self._moon_midnight = get_moon(self.midnight)
+        return self._moon_midnight
+
+    @property
+    def moon_distance(self):
+        skycoord = self.skycoord.reshape(self.skycoord.shape + (1,))
+        return self.moon_midnight.separation(skycoord).to(u.deg).value
+
+    @property
+    def moon_illumination(self):
+        return Visibility.get_moon_illumination(self.midnight)
+
+    def rank(self, min_moon_distance=30.):
+        observable_hours = np.where(self.moon_distance > min_moon_distance,
+                                    self.observable_hours, 0.)
+        ranking = pd.DataFrame({
+            'observable_hours': observable_hours.sum(axis=-1),
+            'observable_nights': (observable_hours > 0).sum(axis=-1),
+            'max_alt': self.max_alt.max(axis=-1),
+            'min_moon_distance': self.moon_distance.min(axis=-1)
+        }, index=self.names)
+        return ranking.sort_values('observable_hours', ascending=False)
+
+
+class GifFrameRenderer(object):
+    def __init__(self, visibility_kwargs, dpi=200):
+        self.visibility = Visibility(**visibility_kwargs)
+        fig = Figure(dpi=dpi)
+        FigureCanvasAgg(fig)
+        self.visibility.plot(fig)
+
+    def __call__(self, offset):
+        self.visibility.update_plot(offset)
+        canvas = self.visibility.fig.canvas
+        canvas.draw()
+        return np.asarray(canvas.buffer_rgba())[..., :3].copy()
+
+
+_gif_renderer = None
+
+
+def _init_gif_worker(visibility_kwargs, dpi):
+    global _gif_renderer
+    _gif_renderer = GifFrameRenderer(visibility_kwargs, dpi)
+
+
+def _render_gif_frame(offset):
+    return _gif_renderer(offset)
+
+
+def get_max_alt_from_frame(df, backend='astropy'):
+    if len(df) == 0:
+        return np.array([])
+    coords = get_sky_coords_from_frame(df)
+    # broadcast the targets against the time grid of a single night
+    vis = Visibility(skycoord=coords[:, np.newaxis], backend=backend)
+    return vis.max_alt.value
 
 
 def get_gal_latitude_from_frame(df):
-    gal_lat = []
-    for index, row in df.iterrows():
-        coord = SkyCoord(row.RA, row.DEC, unit=(u.hourangle, u.deg))
-        gal_lat.append(coord.galactic.b.value)
-    return np.array(gal_lat)
+    if len(df) == 0:
+        return np.array([])
+    return get_sky_coords_from_frame(df).galactic.b.value
 
 
-def insert_max_alt_in_frame(df):
-    max_alt = get_max_alt_from_frame(df)
+def insert_max_alt_in_frame(df, backend='astropy'):
+    max_alt = get_max_alt_from_frame(df, backend=backend)
     df = df.copy()
     df.insert(len(df.columns), 'max_alt', max_alt)
     return df
@@ -1,9 +1,9 @@
 import astropy.units as u
 from IPython.display import HTML
-from astropy.coordinates import SkyCoord
 from ipywidgets import Layout
 import ipyaladin.aladin_widget as ipal
 from jinja2 import Environment, PackageLoader, select_autoescape
+from .coordinates import get_sky_coord_from_row
 
 
 class TargetVisualizer(object):
@@ -25,7 +25,7 @@ class TargetVisualizer(object):
 
     @classmethod
     def from_row(cls, row, fov=0.0333, layout=None):
-        coords = SkyCoord(row.RA, row.DEC, unit=(u.hourangle, u.deg))
+        coords = get_sky_coord_from_row(row)
         return cls(coords, row.name, layout=layout)
 
     @property
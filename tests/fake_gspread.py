@@ -0,0 +1,39 @@
+import gspread
+
+
+class FakeWorksheet(object):
+    def __init__(self, title, header):
+        self.title = title
+        self.rows = [list(header)]
+
+    def row_values(self, row):
+        return list(self.rows[row - 1])
+
+    def col_values(self, col):
+        return [row[col - 1] if len(row) >= col else ''
+                for row in self.rows]
+
+    def insert_row(self, values, index=1):
+        self.rows.insert(index - 1, list(values))
+
+    def insert_rows(self, values, row=1):
+        self.rows[row - 1:row - 1] = [list(value) for value in values]
+
+    def get_all_records(self):
+        return [dict(zip(self.rows[0], row)) for row in self.rows[1:]]
+
+
+class FakeSpreadsheet(object):
+    def __init__(self, titles=('classification targets', 'misc'),
+                 header=('Name',)):
+        self.worksheets = [FakeWorksheet(title, header) for title in titles]
+
+    @property
+    def sheet1(self):
+        return self.worksheets[0]
+
+    def worksheet(self, title):
+        for worksheet in self.worksheets:
+            if worksheet.title == title:
+                return worksheet
+        raise gspread.exceptions.WorksheetNotFound(title)
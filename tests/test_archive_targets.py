@@ -0,0 +1,40 @@
+import pandas as pd
+from fake_gspread import FakeSpreadsheet
+from snII_cosmo_tools.archive_targets import (SheetWriteQueue,
+                                              GspreadTargetArchiver)
+
+
+def test_write_queue_keeps_newest_row_on_top():
+    sheet = FakeSpreadsheet()
+    queue = SheetWriteQueue(sheet)
+    queue.put('classification targets', ['SN 1'])
+    queue.put('classification targets', ['SN 2'])
+    queue.put('misc', ['SN 3'])
+    assert queue.close()
+    assert sheet.worksheet('classification targets').rows == [
+        ['Name'], ['SN 2'], ['SN 1']
+    ]
+    assert sheet.worksheet('misc').rows == [['Name'], ['SN 3']]
+
+
+def test_write_queue_requeues_failed_rows():
+    sheet = FakeSpreadsheet()
+    queue = SheetWriteQueue(sheet)
+    queue.put('unknown worksheet', ['SN 1'])
+    assert not queue.close()
+    assert queue.pending == {'unknown worksheet': [['SN 1']]}
+    assert not queue.thread.is_alive()
+
+
+def test_gspread_archiver_uses_registry(monkeypatch):
+    sheet = FakeSpreadsheet()
+    sheet.sheet1.insert_row(['<a href="https://wis-tns.org">SN 1</a>'], 2)
+    monkeypatch.setattr(GspreadTargetArchiver, 'spreadsheet', sheet)
+    archived = GspreadTargetArchiver(pd.Series({'RA': '01:00:00'},
+                                               name='SN 1'))
+    assert archived.button.disabled
+    new = GspreadTargetArchiver(pd.Series({'RA': '02:00:00'}, name='SN 2'))
+    assert not new.button.disabled
+    new.registry.add('SN 2')
+    assert GspreadTargetArchiver(
+        pd.Series({'RA': '02:00:00'}, name='SN 2')).button.disabled
@@ -0,0 +1,48 @@
+import json
+import zipfile
+import requests
+from datetime import datetime
+from snII_cosmo_tools.http_client import client, ResponseArchive
+from snII_cosmo_tools.tns_downloader import TNSDownloader
+
+
+def write_archive(path, recorded_at, downloader):
+    with zipfile.ZipFile(path, 'w') as archive:
+        archive.writestr(ResponseArchive.recording_fname, json.dumps(
+            {'recorded_at': recorded_at}))
+    response = requests.Response()
+    response.url = downloader.url
+    response.status_code = 200
+    response.reason = 'OK'
+    response.encoding = 'utf-8'
+    response._content = b'Name,RA\nSN 2020abc,01:00:00.00\n'
+    archive = ResponseArchive(path, mode='a')
+    params = dict(downloader.query_dict, page=0, format='csv')
+    archive.store(ResponseArchive.get_key(downloader.url, params), response)
+    archive.close()
+
+
+def test_replay_uses_recording_date(tmp_path):
+    path = str(tmp_path / 'responses.zip')
+    recorded = TNSDownloader(number_of_days=2.,
+                             reference_date=datetime(2020, 3, 1, 12))
+    write_archive(path, '2020-03-01 12:00:00', recorded)
+    with client.replaying(path):
+        assert client.now() == datetime(2020, 3, 1, 12)
+        downloader = TNSDownloader(number_of_days=2.)
+        assert downloader.start_date == '2020-02-28'
+        page = downloader.get_page(0)
+    assert page.Name.tolist() == ['SN 2020abc']
+    assert client.mode == 'live'
+
+
+def test_recording_keeps_first_recording_date(tmp_path):
+    path = str(tmp_path / 'responses.zip')
+    with zipfile.ZipFile(path, 'w') as archive:
+        archive.writestr(ResponseArchive.recording_fname, json.dumps(
+            {'recorded_at': '2020-03-01 12:00:00'}))
+    with client.recording(path):
+        pass
+    archive = ResponseArchive(path)
+    assert archive.recorded_at == datetime(2020, 3, 1, 12)
+    archive.close()
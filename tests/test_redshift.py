@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+import pytest
+import astropy.units as u
+from astropy.coordinates import SkyCoord
+from astropy.cosmology import Planck15
+from snII_cosmo_tools.redshift import GladeRedshiftCatalogue
+from snII_cosmo_tools.catalogue_build import build_catalogue
+
+max_dist_kpc = 40.
+
+
+def make_catalogue(num_galaxies=20000, seed=1):
+    rng = np.random.default_rng(seed)
+    # a uniform background plus galaxies clustered around the targets
+    ra = rng.uniform(0., 360., num_galaxies)
+    dec = np.degrees(np.arcsin(rng.uniform(-1., 1., num_galaxies)))
+    targets = make_targets()
+    num_clustered = num_galaxies // 2
+    host = rng.integers(0, len(targets), num_clustered)
+    ra[:num_clustered] = targets.ra_deg.values[host] + rng.normal(
+        0., 0.01, num_clustered)
+    dec[:num_clustered] = targets.dec_deg.values[host] + rng.normal(
+        0., 0.01, num_clustered)
+    return pd.DataFrame({
+        'RA': np.mod(ra, 360.), 'dec': np.clip(dec, -90., 90.),
+        'z': rng.uniform(0., 0.6, num_galaxies),
+        'name': ['galaxy {}'.format(i) for i in range(num_galaxies)]
+    })
+
+
+def make_targets():
+    ra = np.array([0.001, 45., 120.5, 200., 359.999, 300.])
+    dec = np.array([0., -30., 60., -89.99, 10., 45.])
+    return pd.DataFrame({'ra_deg': ra, 'dec_deg': dec,
+                         'Discovery Mag': np.linspace(17., 20., len(ra))},
+                        index=['SN {}'.format(i) for i in range(len(ra))])
+
+
+def brute_force_matches(data, target_coords, min_z=1e-2, max_z=0.5):
+    data = data[(data.z > min_z) & (data.z < max_z)]
+    coords = SkyCoord(data.RA.values, data.dec.values, unit=u.deg)
+    sep = coords.separation(target_coords).to(u.arcsec).value
+    sep /= Planck15.arcsec_per_kpc_proper(data.z.values).value
+    matches = data[sep < max_dist_kpc].copy()
+    matches['d_proj[kpc]'] = sep[sep < max_dist_kpc]
+    return matches.sort_values('d_proj[kpc]')
+
+
+def assert_same_matches(matches, expected):
+    assert matches.name.tolist() == expected.name.tolist()
+    np.testing.assert_allclose(matches['d_proj[kpc]'].values,
+                               expected['d_proj[kpc]'].values, rtol=1e-8)
+
+
+@pytest.fixture(scope='module')
+def data():
+    return make_catalogue()
+
+
+@pytest.fixture(scope='module', params=['fixed', 'table', 'lazy',
+                                        'columnar'])
+def catalogue(request, data, tmp_path_factory):
+    path = tmp_path_factory.mktemp(request.param)
+    fname = str(path / 'catalogue.hdf')
+    if request.param == 'fixed':
+        data.to_hdf(fname, key='data')
+    else:
+        data.to_hdf(fname, key='data', format='table', data_columns=['z'])
+    if request.param == 'columnar':
+        dest = str(path / 'catalogue.cat')
+        build_catalogue(GladeRedshiftCatalogue, fname, dest)
+        return GladeRedshiftCatalogue(dest)
+    return GladeRedshiftCatalogue(fname, lazy=request.param == 'lazy')
+
+
+def test_find_host_z_matches_brute_force(catalogue, data):
+    targets = make_targets()
+    for ra, dec in zip(targets.ra_deg, targets.dec_deg):
+        target_coords = SkyCoord(ra, dec, unit=u.deg)
+        matches = catalogue.find_host_z(target_coords,
+                                        max_dist_kpc=max_dist_kpc)
+        assert_same_matches(matches,
+                            brute_force_matches(data, target_coords))
+
+
+def test_find_hosts_for_frame_matches_brute_force(catalogue, data):
+    targets = make_targets()
+    matches = catalogue.find_hosts_for_frame(targets,
+                                             max_dist_kpc=max_dist_kpc)
+    assert len(matches) > 0
+    for name, ra, dec in zip(targets.index, targets.ra_deg,
+                             targets.dec_deg):
+        target_coords = SkyCoord(ra, dec, unit=u.deg)
+        assert_same_matches(matches[matches.index == name],
+                            brute_force_matches(data, target_coords))
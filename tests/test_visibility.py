@@ -0,0 +1,31 @@
+import numpy as np
+import astropy.units as u
+from astropy.coordinates import SkyCoord, EarthLocation, Latitude
+from snII_cosmo_tools.visibility import Visibility, VisibilityPlanner
+
+paranal = EarthLocation.from_geodetic(-70.4045 * u.deg, -24.6268 * u.deg,
+                                      2635 * u.m)
+skycoord = SkyCoord(np.linspace(0., 330., 12), np.linspace(-80., 40., 12),
+                    unit=u.deg)
+
+
+def test_fast_alt_matches_astropy():
+    alt = {
+        backend: Visibility(skycoord=skycoord[:, np.newaxis],
+                            location=paranal, backend=backend).alt
+        for backend in Visibility.backends
+    }
+    assert isinstance(alt['fast'], Latitude)
+    assert isinstance(alt['astropy'], Latitude)
+    np.testing.assert_allclose(alt['fast'].deg, alt['astropy'].deg,
+                               atol=0.05)
+
+
+def test_planner_fast_alt_matches_astropy():
+    alt = {
+        backend: VisibilityPlanner(skycoord, number_of_nights=2,
+                                   location=paranal, backend=backend).alt
+        for backend in Visibility.backends
+    }
+    np.testing.assert_allclose(alt['fast'].deg, alt['astropy'].deg,
+                               atol=0.05)